@@ -36,10 +36,17 @@
       search (using the init_search method) and resume the search after
       a goal is found (using searchOpen). See the implementation for details.
 
+      A long search can also be checkpointed to disk (the frontier,
+      the cycle check dictionary, the counters and the best goal found
+      so far) and later resumed with load_checkpoint.
+
     '''
 import heapq
 from collections import deque
 import os
+import pickle
+import threading
+import zlib
 
 
 class StateSpace:
@@ -130,6 +137,10 @@ _CC_PATH = 1
 _CC_FULL = 2
 
 
+#  Version tag written at the start of every checkpoint file.
+_CHECKPOINT_MAGIC = b'SRCHCKPT1'
+
+
 #  Zero Heuristic Function---for uninformed search don't include heur_fn
 #  in call to search engine's search method, defaults heur_fn to the zero fn.
 def _zero_hfn(state):
@@ -255,6 +266,9 @@ class SearchEngine:
     def __init__(self, strategy='depth_first', cc_level='default'):
         self.set_strategy(strategy, cc_level)
         self.trace = 0
+        self.incumbent = None
+        self.checkpoint_file = None
+        self.checkpoint_thread = None
 
     def initStats(self):
         sNode.n = 0
@@ -370,13 +384,18 @@ class SearchEngine:
         self.fval_function = fval_function
         self.goal_fn = goal_fn
         self.heur_fn = heur_fn
+        self.incumbent = None
 
-    def search(self, timebound=10, costbound=None):
+    def search(self, timebound=10, costbound=None, checkpoint=None, checkpoint_interval=60):
         """
-        Start searching, using the parameters set by init_search.
+        Start searching, using the parameters set by init_search (or load_checkpoint).
 
         @param timebound: the maximum amount of time, in seconds, to spend on this search.
         @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+        @param checkpoint: optional file name. If given the search state is written to this
+                           file every checkpoint_interval seconds (in a background thread)
+                           and once more when the search returns.
+        @param checkpoint_interval: seconds between two background checkpoints.
         """
 
         goal_node = []
@@ -386,8 +405,20 @@ class SearchEngine:
         self.search_stop_time = None
         if timebound:
             self.search_stop_time = self.search_start_time + timebound
+        self.checkpoint_file = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint_time = self.search_start_time + checkpoint_interval
         goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
 
+        if goal_node and (self.incumbent is None or goal_node.gval < self.incumbent.gval):
+            self.incumbent = goal_node.state
+
+        if checkpoint:
+            #  wait for any background write, then record the final state
+            self.wait_checkpoint()
+            self.save_checkpoint(checkpoint)
+            self.checkpoint_file = None
+
         if goal_node:
             total_search_time = os.times()[0] - self.search_start_time
             print("Solution Found with cost of {} in search time of {} sec".format(goal_node.gval, total_search_time))
@@ -402,6 +433,143 @@ class SearchEngine:
                 sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned))
             return False
 
+    def save_checkpoint(self, filename):
+        '''Write the current search state (OPEN, the cycle check dictionary,
+           the counters and the incumbent) to filename. Returns True on success.'''
+        return self._write_checkpoint(self._snapshot(), filename)
+
+    def load_checkpoint(self, filename, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function):
+        """
+        Get ready to resume a search from a checkpoint written by save_checkpoint
+        or by search(checkpoint=...). Call search on this object to continue it.
+        Functions are not stored in the checkpoint so they must be given again.
+
+        @param filename: the checkpoint file.
+        @param goal_fn: the goal function for the puzzle
+        @param heur_fn: the heuristic function used when the checkpoint was made
+        @param fval_fn: the f-value function (only relevant for custom search strategy)
+        """
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print("Could not read checkpoint", filename, ":", e)
+            return False
+        if not data.startswith(_CHECKPOINT_MAGIC):
+            print("File", filename, "is not a search checkpoint")
+            return False
+        snapshot = pickle.loads(zlib.decompress(data[len(_CHECKPOINT_MAGIC):]))
+
+        #  rebuild the states, parents always come before their children
+        states = []
+        for cls, attributes, parent in snapshot['states']:
+            state = cls.__new__(cls)
+            state.__dict__.update(attributes)
+            state.parent = states[parent] if parent >= 0 else None
+            states.append(state)
+
+        self.strategy = snapshot['strategy']
+        self.cycle_check = snapshot['cycle_check']
+        self.open = Open(self.strategy)
+        nodes = []
+        for state, hval, index in snapshot['open']:
+            node = sNode(states[state], hval, fval_function)
+            node.index = index
+            nodes.append(node)
+        #  nodes are in OPEN order (heap order for priority queues)
+        self.open.open.extend(nodes)
+
+        if self.cycle_check == _CC_FULL:
+            self.cc_dictionary = snapshot['cc_dictionary']
+        sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned = snapshot['counters']
+        incumbent = snapshot['incumbent']
+        self.incumbent = states[incumbent] if incumbent >= 0 else None
+
+        self.fval_function = fval_function
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
+
+        # BEGIN TRACING
+        if self.trace:
+            print("   TRACE: Resumed {} from {} with {} nodes on OPEN".format(
+                self.get_strategy(), filename, len(nodes)))
+        # END TRACING
+        return True
+
+    def wait_checkpoint(self):
+        '''Block until a background checkpoint write (if any) is finished'''
+        if self.checkpoint_thread:
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+
+    def _start_checkpoint(self):
+        '''Copy the search state and write it out in a background thread.
+           Only the copy is done by the searching thread, so expansion is
+           only held up for the time needed to copy OPEN and the cycle
+           check dictionary.'''
+        if self.checkpoint_thread and self.checkpoint_thread.is_alive():
+            #  previous write still running, try again at the next expansion
+            return
+        self.checkpoint_thread = threading.Thread(
+            target=self._write_checkpoint, args=(self._snapshot(), self.checkpoint_file))
+        self.checkpoint_thread.daemon = True
+        self.checkpoint_thread.start()
+        self.next_checkpoint_time = os.times()[0] + self.checkpoint_interval
+
+    def _snapshot(self):
+        '''Internal routine. Shallow copy of the search state. States are never
+           changed once generated so they can be shared with the copy.'''
+        cc_dictionary = None
+        if self.cycle_check == _CC_FULL:
+            cc_dictionary = dict(self.cc_dictionary)
+        return {
+            'strategy': self.strategy,
+            'cycle_check': self.cycle_check,
+            'open': [(node.state, node.hval, node.index) for node in self.open.open],
+            'cc_dictionary': cc_dictionary,
+            'counters': (sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned),
+            'incumbent': self.incumbent,
+        }
+
+    def _write_checkpoint(self, snapshot, filename):
+        '''Internal routine. Serialize a snapshot to filename. States are
+           stored in one flat table with parents replaced by table indices,
+           so long paths do not make pickle recurse once per ancestor.'''
+        ids = dict()
+        states = []
+
+        def state_id(state):
+            if state is None:
+                return -1
+            chain = []
+            s = state
+            while s is not None and id(s) not in ids:
+                chain.append(s)
+                s = s.parent
+            while chain:
+                s = chain.pop()
+                attributes = dict(s.__dict__)
+                del attributes['parent']
+                states.append((type(s), attributes, ids[id(s.parent)] if s.parent is not None else -1))
+                ids[id(s)] = len(states) - 1
+            return ids[id(state)]
+
+        snapshot = dict(snapshot)
+        snapshot['open'] = [(state_id(state), hval, index) for state, hval, index in snapshot['open']]
+        snapshot['incumbent'] = state_id(snapshot['incumbent'])
+        snapshot['states'] = states
+
+        data = zlib.compress(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL), 1)
+        try:
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(_CHECKPOINT_MAGIC)
+                f.write(data)
+            os.replace(filename + '.tmp', filename)
+        except OSError as e:
+            print("Could not write checkpoint", filename, ":", e)
+            return False
+        return True
+
     def _searchOpen(self, goal_fn, heur_fn, fval_function, costbound):
         """
         Search, starting from self.open.
@@ -419,6 +587,16 @@ class SearchEngine:
                 print("   TRACE: Initial CC_Dict:", self.cc_dictionary)
         # END TRACING
         while not self.open.empty():
+            if self.checkpoint_file:
+                #  stop or checkpoint before taking a node off OPEN, so the
+                #  checkpoint holds the whole frontier in its current order
+                now = os.times()[0]
+                if self.search_stop_time and now > self.search_stop_time:
+                    print("TRACE: Search has exceeeded the time bound provided.")
+                    return False
+                if now >= self.next_checkpoint_time:
+                    self._start_checkpoint()
+
             node = self.open.extract()
 
             # BEGIN TRACING
@@ -433,7 +611,7 @@ class SearchEngine:
                 #  node at front of OPEN is a goal...search is completed.
                 return node
 
-            if self.search_stop_time:  # timebound check
+            if self.search_stop_time and not self.checkpoint_file:  # timebound check
                 if os.times()[0] > self.search_stop_time:
                     # exceeded time bound, must terminate search
                     print("TRACE: Search has exceeeded the time bound provided.")
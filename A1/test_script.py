@@ -2,11 +2,15 @@
 # import student's functions
 from solution import *
 
+import os
+import tempfile
+
 # Select what to test
 test_manhattan = True
 test_anytime_gbfs = True
 test_anytime_weighted_astar = True
 test_fval_function = True
+test_checkpoint = True
 
 if test_manhattan:
     ##############################################################
@@ -141,3 +145,54 @@ if test_fval_function:
     print("Your fval_function calculated the correct fval for {} out of {} tests.".format(solved, len(correct_fvals)))
     print("*************************************\n")
     ##############################################################
+
+
+if test_checkpoint:
+
+    ##############################################################
+    # TEST CHECKPOINT AND RESUME
+    print("*************************************")
+    print('Testing checkpoint and resume')
+
+    def path_states(state):
+        path = []
+        while state is not None:
+            path.append(state.hashable_state())
+            state = state.parent
+        return path
+
+    checkpoint = os.path.join(tempfile.gettempdir(), 'test_script_checkpoint')
+    solved = 0
+    unsolved = []
+    timebound = 8  # 8 second time limit
+    for i in range(2, 6):
+        print("PROBLEM {}".format(i))
+
+        s0 = PROBLEMS[i]
+        se = SearchEngine('astar', 'full')
+        se.init_search(s0, sokoban_goal_state, heur_manhattan_distance)
+        final = se.search(timebound=timebound)
+
+        # stop the same search after 0.05 seconds and resume it from its checkpoint
+        se = SearchEngine('astar', 'full')
+        se.init_search(s0, sokoban_goal_state, heur_manhattan_distance)
+        stopped = se.search(timebound=0.05, checkpoint=checkpoint)
+        se = SearchEngine()
+        resumed = False
+        if se.load_checkpoint(checkpoint, sokoban_goal_state, heur_manhattan_distance):
+            resumed = se.search(timebound=timebound)
+
+        if stopped is False and final and resumed and resumed.gval == final.gval \
+           and path_states(resumed) == path_states(final):
+            solved += 1
+        else:
+            unsolved.append(i)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    print("\n*************************************")
+    print("Of 4 searches stopped on their timebound, {} resumed from a checkpoint to the same solution and cost as an uninterrupted search.".format(solved))
+    print("Problems that did not: {}".format(unsolved))
+    print("*************************************\n")
+    ##############################################################
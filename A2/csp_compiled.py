@@ -0,0 +1,403 @@
+'''Compiling a CSP into a flat integer representation.
+
+   bt_search works on Variable and Constraint objects: every step of the
+   propagators goes through their methods, dictionaries keyed by
+   variables, and domain values that are arbitrary python objects.
+   CompiledCSP translates a CSP once into integers
+
+   - variable ids 0..n-1 (the position of the variable in the CSP) and
+     value indices 0..d-1 (the position of the value in the variable's
+     domain), with domains as bitmasks over the value indices
+   - for each constraint its kind and its scope, given as variable ids
+     in one flat array (CSR: the scope of constraint c is
+     scope_vars[scope_start[c]:scope_start[c + 1]])
+   - the constraints of each variable (vars_to_cons) in CSR form as
+     well: adj_cons[adj_start[v]:adj_start[v + 1]] are the constraints
+     of variable v and adj_pos the positions of v in their scopes
+   - the data of each kind of constraint: array tuple tables (the
+     TupleTable rows of table constraints, or the tuples of a generic
+     FunctionConstraint enumerated at compile time), support masks of
+     binary tables (taken from the table as search needs them), and
+     for value based constraints (not-equal, all-different, linear)
+     arrays mapping value indices to global value ids or numbers
+
+   CompiledCSP.solve runs forward checking search with the minimum
+   remaining values ordering on that representation, using only lists
+   and arrays of integers, and maps the solution back to the CSP's
+   Variable objects.
+
+   (array tables rather than numpy ones, numpy is not a dependency of
+   this code.)
+'''
+
+import itertools
+import time
+from array import array
+
+from cspbase import *
+from cspbase import _popcount
+
+TABLE, BINARY, NOT_EQUAL, ALL_DIFF, LINEAR = range(5)
+
+class CompiledCSP:
+    '''Flat integer representation of a CSP (see above). Compile with
+       CompiledCSP(csp); ok is False if some constraint could not be
+       compiled (a FunctionConstraint with more than max_tuples tuples
+       over its domains). tie_break is 'position' or 'degree', as in
+       BT.set_tie_break.'''
+
+    def __init__(self, csp, max_tuples=1000000, tie_break='position'):
+        self.csp = csp
+        self.variables = csp.get_all_vars()     #variable id --> Variable
+        self.n_vars = len(self.variables)
+        ids = dict()
+        for i, var in enumerate(self.variables):
+            ids[var] = i
+        self.values = [var.domain() for var in self.variables]
+        self.ok = True
+        self.nDecisions = 0
+        self.nPrunings = 0
+        self.runtime = 0
+
+        #initial domains, restricted by CSP.add_assignment
+        self.domains = [(1 << len(vals)) - 1 for vals in self.values]
+        for var, value in csp.get_assignments():
+            self.domains[ids[var]] &= 1 << var.value_index(value)
+
+        #global value ids, so value based constraints can compare the
+        #values of variables with different domains
+        gids = dict()
+        self.gid = [array('I', [gids.setdefault(val, len(gids)) for val in vals])
+                    for vals in self.values]
+        self.n_gids = len(gids)
+        self.index = []     #index[v][g] is the index of value g in v's domain or -1
+        for v in range(self.n_vars):
+            index = array('i', [-1]) * self.n_gids
+            for x, g in enumerate(self.gid[v]):
+                index[g] = x
+            self.index.append(index)
+
+        constraints = csp.get_all_cons()
+        self.n_cons = len(constraints)
+        self.kind = array('B')
+        self.scope_start = array('I', [0])
+        self.scope_vars = array('I')
+        self.data = []
+        for c in constraints:
+            kind, data = self.compile_constraint(c, max_tuples)
+            if kind is None:
+                self.ok = False
+                print("ERROR: constraint", c, "has too many tuples to compile")
+                kind, data = TABLE, None
+            self.kind.append(kind)
+            self.data.append(data)
+            self.scope_vars.extend(ids[var] for var in c.get_scope())
+            self.scope_start.append(len(self.scope_vars))
+        self.arity = array('I', [self.scope_start[c + 1] - self.scope_start[c]
+                                 for c in range(self.n_cons)])
+
+        #CSR adjacency
+        incident = [[] for _ in range(self.n_vars)]
+        for c in range(self.n_cons):
+            for pos in range(self.arity[c]):
+                incident[self.scope_vars[self.scope_start[c] + pos]].append((c, pos))
+        self.adj_start = array('I', [0])
+        self.adj_cons = array('I')
+        self.adj_pos = array('I')
+        for v in range(self.n_vars):
+            for c, pos in incident[v]:
+                self.adj_cons.append(c)
+                self.adj_pos.append(pos)
+            self.adj_start.append(len(self.adj_cons))
+
+        #variables in tie breaking order of BT's mrv
+        if tie_break == 'degree':
+            self.order = sorted(range(self.n_vars),
+                                key=lambda v: (-(self.adj_start[v + 1] - self.adj_start[v]), v))
+        else:
+            self.order = list(range(self.n_vars))
+
+    def compile_constraint(self, c, max_tuples):
+        '''Internal routine. Return (kind, data) of constraint c:
+           TABLE:     (rows, supports) with rows the flat array of index
+                      tuples and supports[i][x] the rows whose i'th
+                      index is x
+           BINARY:    (table, proj) for a table of arity 2, with
+                      proj[i][x] the bitmask of the indices of the other
+                      position in the rows whose i'th index is x, None
+                      until search needs it (it is then taken from
+                      table.projection, which tables shared by many
+                      constraints only compute once)
+           NOT_EQUAL, ALL_DIFF: None (values compared by global id)
+           LINEAR:    (coefficients, total, numbers) with numbers[i] the
+                      values of the i'th variable as an array
+           (None, None) if c can't be compiled.'''
+        scope = c.get_scope()
+        if isinstance(c, NotEqualConstraint):
+            return NOT_EQUAL, None
+        if isinstance(c, AllDiffConstraint):
+            return ALL_DIFF, None
+        if isinstance(c, LinearConstraint) and \
+           all(isinstance(x, int) for var in scope for x in var.domain()):
+            return LINEAR, (array('q', c.coefficients), c.total,
+                            [array('q', var.domain()) for var in scope])
+
+        if isinstance(c, FunctionConstraint):
+            size = 1
+            for var in scope:
+                size = size * var.domain_size()
+            if size > max_tuples:
+                return None, None
+            table = TupleTable([var.domain_size() for var in scope])
+            table.add_rows(t for t in itertools.product(*[range(var.domain_size()) for var in scope])
+                           if c.check([var.dom[x] for var, x in zip(scope, t)]))
+        else:
+            table = c.table
+
+        k = table.arity
+        if k == 2:
+            return BINARY, (table, [[None] * var.domain_size() for var in scope])
+        supports = []
+        for i, var in enumerate(scope):
+            supports.append([table.supports[i].get(x, array('I'))
+                             for x in range(var.domain_size())])
+        return TABLE, (array(table.rows.typecode, table.rows[:table.n_rows * k]),
+                       supports)
+
+    def solve(self):
+        '''Forward checking search with the mrv ordering (ties broken
+           as in BT). A constraint with one unassigned variable
+           left prunes it (as prop_FC does), and assigning a variable of
+           a not-equal or all-different constraint prunes its value from
+           the other unassigned variables of the constraint. Returns the
+           solution as a list of (Variable, value), or None.
+           nDecisions, nPrunings and runtime are the counters of the
+           search.'''
+        stime = time.process_time()
+        self.nDecisions = 0
+        self.nPrunings = 0
+        solution = None
+        if self.ok:
+            solution = self.search()
+        self.runtime = time.process_time() - stime
+        if solution is None:
+            return None
+        return [(var, vals[x]) for var, vals, x in zip(self.variables, self.values, solution)]
+
+    def search(self):
+        '''Internal routine. The search of solve, returns the list of
+           value indices of a solution or None.'''
+        n = self.n_vars
+        kind = self.kind
+        data = self.data
+        scope_start = self.scope_start
+        scope_vars = self.scope_vars
+        adj_start = self.adj_start
+        adj_cons = self.adj_cons
+        adj_pos = self.adj_pos
+        gid = self.gid
+        index = self.index
+        order = self.order
+
+        dom = list(self.domains)
+        val = [-1] * n                  #value index of each variable, -1 if unassigned
+        nun = list(self.arity)          #unassigned variables of each constraint
+        trail = []                      #(variable, old domain), undone in reverse
+        pruned = [0]
+
+        def project(c, pos, x):
+            '''Bitmask of the values of the other variable of binary
+               constraint c supporting value x at position pos'''
+            table, proj = data[c]
+            mask = proj[pos][x]
+            if mask is None:
+                mask = proj[pos][x] = table.projection(pos, x)
+            return mask
+
+        def restrict(u, mask):
+            '''Keep only the values of u in mask, False on a wipeout'''
+            old = dom[u]
+            new = old & mask
+            if new != old:
+                trail.append((u, old))
+                dom[u] = new
+                pruned[0] += _popcount(old ^ new)
+            return new != 0
+
+        def revise(c):
+            '''Forward check constraint c with one unassigned variable'''
+            start = scope_start[c]
+            end = scope_start[c + 1]
+            u = -1
+            for i in range(start, end):
+                if val[scope_vars[i]] < 0:
+                    u = scope_vars[i]
+                    pos = i - start
+                    break
+            k = kind[c]
+            if k == BINARY:
+                other = 1 - pos
+                return restrict(u, project(c, other, val[scope_vars[start + other]]))
+            if k == TABLE:
+                rows, supports = data[c]
+                arity = end - start
+                best = None
+                for i in range(arity):
+                    if i != pos:
+                        sup = supports[i][val[scope_vars[start + i]]]
+                        if best is None or len(sup) < len(best):
+                            best = sup
+                if best is None:
+                    best = range(len(rows) // arity)
+                allowed = 0
+                for r in best:
+                    base = r * arity
+                    for i in range(arity):
+                        if i != pos and rows[base + i] != val[scope_vars[start + i]]:
+                            break
+                    else:
+                        allowed |= 1 << rows[base + pos]
+                return restrict(u, allowed)
+            if k == LINEAR:
+                coefficients, total, numbers = data[c]
+                rest = total
+                for i in range(end - start):
+                    if i != pos:
+                        rest -= coefficients[i] * numbers[i][val[scope_vars[start + i]]]
+                a = coefficients[pos]
+                allowed = 0
+                for x, number in enumerate(numbers[pos]):
+                    if a * number == rest:
+                        allowed |= 1 << x
+                return restrict(u, allowed)
+            return True
+
+        def propagate(v):
+            '''Forward check the constraints of v, just assigned'''
+            x = val[v]
+            g = gid[v][x]
+            for k in range(adj_start[v], adj_start[v + 1]):
+                c = adj_cons[k]
+                kc = kind[c]
+                if kc == BINARY:
+                    if nun[c] == 1:
+                        pos = adj_pos[k]
+                        u = scope_vars[scope_start[c] + 1 - pos]
+                        table, proj = data[c]
+                        mask = proj[pos][x]
+                        if mask is None:
+                            mask = proj[pos][x] = table.projection(pos, x)
+                        old = dom[u]
+                        new = old & mask
+                        if new != old:
+                            trail.append((u, old))
+                            dom[u] = new
+                            pruned[0] += _popcount(old ^ new)
+                            if not new:
+                                return False
+                elif kc == NOT_EQUAL or kc == ALL_DIFF:
+                    for i in range(scope_start[c], scope_start[c + 1]):
+                        u = scope_vars[i]
+                        if val[u] < 0:
+                            y = index[u][g]
+                            if y >= 0 and not restrict(u, ~(1 << y)):
+                                return False
+                elif nun[c] == 1 and not revise(c):
+                    return False
+            return True
+
+        def select():
+            '''Unassigned variable with the fewest values, or -1'''
+            best = -1
+            size = 0
+            for v in order:
+                if val[v] < 0:
+                    s = _popcount(dom[v])
+                    if best < 0 or s < size:
+                        best = v
+                        size = s
+                        if s <= 1:
+                            break
+            return best
+
+        #root: forward check the unary constraints
+        for c in range(self.n_cons):
+            if nun[c] == 1 and kind[c] in (TABLE, BINARY, LINEAR) and not revise(c):
+                return None
+
+        stack = []      #[variable, values left to try, trail length]
+        v = select()
+        if v >= 0:
+            stack.append([v, dom[v], len(trail)])
+        while stack:
+            top = stack[-1]
+            v, rest, mark = top
+            if val[v] >= 0:
+                #undo the last value tried
+                while len(trail) > mark:
+                    u, old = trail.pop()
+                    dom[u] = old
+                val[v] = -1
+                for k in range(adj_start[v], adj_start[v + 1]):
+                    nun[adj_cons[k]] += 1
+            if not rest:
+                stack.pop()
+                continue
+            low = rest & -rest
+            top[1] = rest ^ low
+            val[v] = low.bit_length() - 1
+            self.nDecisions = self.nDecisions + 1
+            for k in range(adj_start[v], adj_start[v + 1]):
+                nun[adj_cons[k]] -= 1
+            if propagate(v):
+                u = select()
+                if u < 0:
+                    break
+                stack.append([u, dom[u], len(trail)])
+        self.nPrunings = pruned[0]
+
+        if any(x < 0 for x in val):
+            return None
+        return val
+
+    def assign(self, solution):
+        '''Assign the CSP's variables to solution, as returned by solve
+           (like bt_search leaves them)'''
+        for var, value in solution:
+            if var.is_assigned():
+                var.unassign()
+            var.restore_curdom()
+            var.assign(value)
+
+if __name__ == "__main__":
+    import io
+    import contextlib
+    from propagators import *
+    from tenner_csp import *
+    from tenner_sample_run import b1, b2
+    from csp_sample_run import nQueens
+
+    #the speedup is of compiling and solving together over bt_search
+    print("{:>12} {:>10} {:>9} {:>10} {:>9} {:>9} {:>10}".format(
+        "instance", "search", "compile", "decisions", "solve", "total", "speedup"))
+    for name, build in (("tenner b1", lambda: tenner_csp_model_1(b1)[0]),
+                        ("tenner b2", lambda: tenner_csp_model_1(b2)[0]),
+                        ("60-queens", lambda: nQueens(60))):
+        csp = build()
+        solver = BT(csp)
+        stime = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver.bt_search(prop_FC)
+        base = time.process_time() - stime
+        print("{:>12} {:>10} {:>9} {:>10} {:>9.3f} {:>9.3f}".format(
+            name, "bt_search", "", solver.nDecisions, base, base))
+
+        csp = build()
+        stime = time.process_time()
+        compiled = CompiledCSP(csp)
+        ctime = time.process_time() - stime
+        solution = compiled.solve()
+        total = ctime + compiled.runtime
+        print("{:>12} {:>10} {:>9.3f} {:>10} {:>9.3f} {:>9.3f} {:>9.1f}x".format(
+            name, "compiled", ctime, compiled.nDecisions, compiled.runtime,
+            total, base / max(total, 1e-9)))
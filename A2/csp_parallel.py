@@ -0,0 +1,205 @@
+'''Parallel bt_search by splitting the search space across processes.
+
+   The top of the search tree is expanded in this process, branching on
+   the variables picked by the BT variable ordering, until there are
+   many small subproblems (embarrassingly parallel search). Each
+   subproblem is the list of assignments on its branch. The subproblems
+   are solved by a multiprocessing pool, and the first solution found
+   stops the search.
+
+   CSP objects are not sent to the workers. Each worker rebuilds the
+   CSP once from a picklable model description
+
+   model == (function, args)
+
+   where function(*args) returns a CSP object, or a tuple whose first
+   element is the CSP object (as the tenner_csp models do). function
+   must be defined at the top level of a module so it can be pickled,
+   and so must the propagator. Since every process builds the same
+   model, the subproblems refer to variables by their position in
+   csp.get_all_vars().
+'''
+
+import multiprocessing
+import time
+
+from cspbase import *
+
+def build_model(model):
+    '''Return (csp, built) where built is what the model function returned'''
+    function, args = model
+    built = function(*args)
+    if isinstance(built, tuple):
+        return built[0], built
+    return built, built
+
+def fix_values(solver, propagator, assignments):
+    '''Restrict the domains of a search set up by solver.bt_start to the
+       assignments, a list of (variable position, value), and propagate
+       them. Returns False if this gives a deadend.'''
+    variables = solver.csp.get_all_vars()
+    for i, val in assignments:
+        var = variables[i]
+        if not var.in_cur_domain(val):
+            return False
+        for other in var.cur_domain():
+            if other != val:
+                var.prune_value(other)
+    status, prunings = propagator(solver.csp)
+    solver.nPrunings = solver.nPrunings + len(prunings)
+    return status
+
+def split(solver, propagator, depth, position, prefix, subproblems):
+    '''Expand the search set up by solver.bt_start down to depth
+       assignments, adding the prefix of every branch the propagator
+       does not reject to subproblems (position maps each variable to
+       its position in the CSP). Returns True (leaving the
+       variables assigned) if a solution is found before depth.'''
+    if not solver.unasgn_vars:
+        return True
+    if len(prefix) == depth:
+        subproblems.append(list(prefix))
+        return False
+
+    var = solver.extractMRVvar()
+    for val in var.cur_domain():
+        solver.trail.push_level()
+        var.assign(val)
+        solver.nDecisions = solver.nDecisions + 1
+        status, prunings = propagator(solver.csp, var)
+        solver.nPrunings = solver.nPrunings + len(prunings)
+        if status:
+            prefix.append((position[var], val))
+            if split(solver, propagator, depth, position, prefix, subproblems):
+                return True
+            prefix.pop()
+        else:
+            solver.nFails = solver.nFails + 1
+        solver.trail.pop_level()
+        var.unassign()
+    solver.restoreUnasgnVar(var)
+    return False
+
+def make_subproblems(solver, propagator, n_subproblems):
+    '''Split the search set up by solver.bt_start into at least
+       n_subproblems subproblems (fewer if the tree is too small),
+       one level deeper at a time. Returns (solved, subproblems).'''
+    position = dict()
+    for i, var in enumerate(solver.csp.get_all_vars()):
+        position[var] = i
+    depth = 1
+    while True:
+        subproblems = []
+        if split(solver, propagator, depth, position, [], subproblems):
+            return True, []
+        if len(subproblems) >= n_subproblems or not subproblems \
+           or depth >= len(solver.csp.get_all_vars()):
+            return False, subproblems
+        depth = depth + 1
+
+#
+#worker processes
+#
+
+_worker_solver = None
+_worker_propagator = None
+
+def _init_worker(model, propagator, configure):
+    '''Pool initializer, build the worker's copy of the CSP once'''
+    global _worker_solver, _worker_propagator
+    csp, built = build_model(model)
+    _worker_solver = BT(csp)
+    if configure is not None:
+        configure(_worker_solver)
+    _worker_propagator = propagator
+
+def _solve_subproblem(assignments):
+    '''Solve one subproblem in a worker. Returns (solution, nDecisions,
+       nPrunings), solution is the list of values of the CSP's variables
+       or None.'''
+    solver = _worker_solver
+    propagator = _worker_propagator
+    solver.clear_stats()
+    status = solver.bt_start(propagator)
+    if status:
+        status = fix_values(solver, propagator, assignments)
+    if status:
+        status = solver.bt_resume()
+    solution = None
+    if status:
+        solution = [var.get_assigned_value() for var in solver.csp.get_all_vars()]
+    solver.bt_stop()
+    for var in solver.csp.get_all_vars():
+        if var.is_assigned():
+            var.unassign()
+    return solution, solver.nDecisions, solver.nPrunings
+
+def parallel_bt_search(model, propagator, processes=None,
+                       subproblems_per_process=30, configure=None):
+    '''Solve the CSP described by model (see above) with propagator,
+       using a pool of processes (default os.cpu_count()) that solves
+       about subproblems_per_process subproblems each. configure is an
+       optional picklable function called on every BT object before
+       searching (e.g. to set the variable ordering).
+
+       Returns (status, built): status is True if a solution was found,
+       built is what the model function returned in this process, with
+       its variables assigned to the solution. Reports like bt_search,
+       with the statistics summed over all processes.'''
+
+    stime = time.process_time()
+    wtime = time.time()
+    csp, built = build_model(model)
+    solver = BT(csp)
+    if configure is not None:
+        configure(solver)
+    solver.clear_stats()
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    status = solver.bt_start(propagator)
+    subproblems = []
+    if status:
+        status, subproblems = make_subproblems(
+            solver, propagator, processes * subproblems_per_process)
+    solver.bt_stop()
+    nDecisions = solver.nDecisions
+    nPrunings = solver.nPrunings
+
+    if not status and subproblems:
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (model, propagator, configure)) as pool:
+            for solution, d, p in pool.imap_unordered(_solve_subproblem,
+                                                      subproblems):
+                nDecisions = nDecisions + d
+                nPrunings = nPrunings + p
+                if solution is not None:
+                    for var, val in zip(csp.get_all_vars(), solution):
+                        var.assign(val)
+                    status = True
+                    break
+            #leaving the with block terminates the remaining workers
+
+    if status:
+        print("CSP {} solved. CPU Time used = {} Wall time = {}".format(
+            csp.name, time.process_time() - stime, time.time() - wtime))
+        csp.print_soln()
+    else:
+        print("CSP{} unsolved. Has no solutions".format(csp.name))
+    print("parallel_bt_search finished: {} subproblems on {} processes".format(
+        len(subproblems), processes))
+    print("Search made {} variable assignments and pruned {} variable values".format(
+        nDecisions, nPrunings))
+    return status, built
+
+if __name__ == "__main__":
+    from tenner_csp import *
+    from propagators import *
+    from tenner_sample_run import b1, b2, print_tenner_soln
+
+    for b in [b1, b2]:
+        print("=======================================================")
+        print("Model 1 FC")
+        status, (csp, var_array) = parallel_bt_search(
+            (tenner_csp_model_1, (b,)), prop_FC)
+        print_tenner_soln(var_array)
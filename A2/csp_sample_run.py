@@ -39,17 +39,18 @@ simpleCSP = CSP("SimpleEqs", [x,y,z,w])
 simpleCSP.add_constraint(c1)
 simpleCSP.add_constraint(c2)
 
-btracker = BT(simpleCSP)
-#btracker.trace_on()
-
-print("Plain Bactracking on simple CSP")
-btracker.bt_search(prop_BT)
-print("=======================================================")
-print("Forward Checking on simple CSP")
-btracker.bt_search(prop_FC)
-print("=======================================================")
-print("GAC on simple CSP")
-btracker.bt_search(prop_GAC)
+if __name__ == "__main__":
+    btracker = BT(simpleCSP)
+    #btracker.trace_on()
+
+    print("Plain Bactracking on simple CSP")
+    btracker.bt_search(prop_BT)
+    print("=======================================================")
+    print("Forward Checking on simple CSP")
+    btracker.bt_search(prop_FC)
+    print("=======================================================")
+    print("GAC on simple CSP")
+    btracker.bt_search(prop_GAC)
 
 #Now n-Queens example
 
@@ -86,6 +87,24 @@ def nQueens(n):
         csp.add_constraint(c)
     return csp
 
+def add_nQueens_symmetries(csp):
+    '''Declare the 7 rotations and reflections of the board on an
+       n-queens CSP made by nQueens. Qi = j is the queen on row i,
+       column j.'''
+    vars = csp.get_all_vars()
+    n = len(vars)
+    for move in [lambda r, c: (c, n + 1 - r),           #rotations
+                 lambda r, c: (n + 1 - r, n + 1 - c),
+                 lambda r, c: (n + 1 - c, r),
+                 lambda r, c: (n + 1 - r, c),           #reflections
+                 lambda r, c: (r, n + 1 - c),
+                 lambda r, c: (c, r),
+                 lambda r, c: (n + 1 - c, n + 1 - r)]:
+        def symmetry(var, val, move=move):
+            r, c = move(vars.index(var) + 1, val)
+            return vars[r - 1], c
+        csp.add_symmetry(symmetry)
+
 def solve_nQueens(n, propType, trace=False):
     csp = nQueens(n)
     solver = BT(csp)
@@ -98,14 +117,15 @@ def solve_nQueens(n, propType, trace=False):
     elif propType == 'GAC':
         solver.bt_search(prop_GAC)
         
-#trace = True
-trace = False
-print("Plain Bactracking on 8-queens")
-solve_nQueens(8, 'BT', trace)
-print("=======================================================")
-print("Forward Checking 8-queens")
-solve_nQueens(8, 'FC', trace)
-print("=======================================================")
-print("GAC 8-queens")
-solve_nQueens(8, 'GAC', trace)
+if __name__ == "__main__":
+    #trace = True
+    trace = False
+    print("Plain Bactracking on 8-queens")
+    solve_nQueens(8, 'BT', trace)
+    print("=======================================================")
+    print("Forward Checking 8-queens")
+    solve_nQueens(8, 'FC', trace)
+    print("=======================================================")
+    print("GAC 8-queens")
+    solve_nQueens(8, 'GAC', trace)
 
@@ -1,5 +1,18 @@
 import time
 import functools
+import itertools
+import bisect
+import heapq
+import weakref
+import random
+from array import array
+
+#number of set bits in an integer (int.bit_count is only in newer pythons)
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:
+    def _popcount(mask):
+        return bin(mask).count('1')
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -11,7 +24,8 @@ import functools
       added but NOT deleted from.
       
       To support constraint propagation, the class also maintains a
-      set of flags to indicate if a value is still in its current domain.
+      bitmask (one bit per domain value) to indicate if a value is
+      still in its current domain.
       So one can remove values, add them back, and query if they are 
       still current. 
 
@@ -30,10 +44,41 @@ import functools
       for each variable in the constraint (in the same ORDER as the
       variables of the constraint were specified).
 
+      Subclasses define constraints intensionally instead, by a
+      predicate (FunctionConstraint) or as not-equal, all-different
+      and linear sum constraints with their own domain filtering. The
+      propagators reach that filtering through the constraint's
+      revise and forward_check methods.
+
     C) Backtracking routine---takes propagator and CSP as arguments
        so that basic backtracking, forward-checking or GAC can be 
        executed depending on the propagator used.
 
+    D) class Trail
+
+      An undo stack used by the backtracking routine. While a variable
+      is attached to a trail, the first change to its current domain at
+      each search level saves the old domain bitmask on the trail, so
+      backtracking restores every changed variable in one pass.
+
+    E) class MRVBuckets
+
+      The set of unassigned variables kept by the backtracking routine,
+      bucketed by current domain size so the minimum remaining values
+      variable can be found without scanning every variable.
+
+    F) class NogoodStore
+
+      Nogoods (combinations of assignments that cannot be extended to
+      a solution) learned by the backtracking routine when it does
+      conflict directed backjumping, indexed by two watched literals.
+
+    G) class SearchStats
+
+      Statistics of a search, returned by the backtracking routine:
+      counters, time spent propagating, decisions per depth, and the
+      revisions and prunings made by each constraint.
+
 '''
 
 class Variable: 
@@ -41,12 +86,14 @@ class Variable:
     '''Class for defining CSP variables.  On initialization the
        variable object should be given a name, and optionally a list of
        domain values. Later on more domain values an be added...but
-       domain values can never be removed.
+       domain values can never be removed. Domain values must be
+       hashable, they are indexed by a dictionary.
 
        The variable object offers two types of functionality to support
        search. 
-       (a) It has a current domain, implimented as a set of flags 
-           determining which domain values are "current", i.e., unpruned.
+       (a) It has a current domain, implimented as an integer bitmask:
+           bit i is set if and only if the i'th domain value is
+           "current", i.e., unpruned.
            - you can prune a value, and restore it.
            - you can obtain a list of values in the current domain, or count
              how many are still there
@@ -72,6 +119,12 @@ class Variable:
            flags are not changed so that pruning and unpruning can
            work independently of assignment and unassignment. 
            '''
+
+    #Propagators call these methods very often, so avoid a per object
+    #__dict__ and keep the state in fixed slots.
+    __slots__ = ('name', 'dom', 'curdom', 'assignedValue', 'val_index', 'full_mask',
+                 'trail', 'trail_stamp', 'mrv', 'watchers')
+
     #
     #set up and info methods
     #
@@ -81,16 +134,30 @@ class Variable:
         '''
         self.name = name                #text name for variable
         self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.val_index = dict()         #value --> position in self.dom
+        for i, val in enumerate(self.dom):
+            self.val_index.setdefault(val, i)
+        self.full_mask = (1 << len(self.dom)) - 1
+        self.curdom = self.full_mask    #bitmask over self.dom
         #for bt_search
         self.assignedValue = None
+        self.trail = None               #Trail saving curdom during search
+        self.trail_stamp = -1           #stamp of the level last saved on
+        self.mrv = None                 #MRVBuckets told about size changes
+        self.watchers = []              #(constraint, position) for each
+                                        #constraint of a CSP the variable
+                                        #is in (see Constraint.watch)
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
            Removals not supported removals'''
         for val in values: 
+            self.val_index.setdefault(val, len(self.dom))
+            self.curdom |= 1 << len(self.dom)
+            self.full_mask |= 1 << len(self.dom)
             self.dom.append(val)
-            self.curdom.append(True)
+        if self.mrv is not None:
+            self.mrv.update(self)
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -106,53 +173,71 @@ class Variable:
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        if self.trail is not None and self.trail_stamp != self.trail.stamp:
+            self.trail.save(self)
+        self.curdom &= ~(1 << self.val_index[value])
+        if self.mrv is not None:
+            self.mrv.update(self)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        if self.trail is not None and self.trail_stamp != self.trail.stamp:
+            self.trail.save(self)
+        self.curdom |= 1 << self.val_index[value]
+        if self.mrv is not None:
+            self.mrv.update(self)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
            only assigned value is viewed as being in current domain)'''
-        vals = []
         if self.is_assigned():
-            vals.append(self.get_assigned_value())
-        else:
-            for i, val in enumerate(self.dom):
-                if self.curdom[i]:
-                    vals.append(val)
+            return [self.get_assigned_value()]
+        vals = []
+        mask = self.curdom
+        while mask:
+            low = mask & -mask          #lowest set bit
+            vals.append(self.dom[low.bit_length() - 1])
+            mask ^= low
         return vals
 
     def in_cur_domain(self, value):
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        i = self.val_index.get(value)
+        if i is None:
             return False
         if self.is_assigned():
             return value == self.get_assigned_value()
         else:
-            return self.curdom[self.value_index(value)]
+            return (self.curdom >> i) & 1 == 1
+
+    def cur_domain_mask(self):
+        '''Return the CURRENT domain as a bitmask over domain indices
+           (if assigned only the assigned value's bit is set)'''
+        if self.is_assigned():
+            return 1 << self.val_index[self.assignedValue]
+        return self.curdom
 
     def cur_domain_size(self):
         '''Return the size of the variables domain (without construcing list)'''
         if self.is_assigned():
             return 1
         else:
-            return(sum(1 for v in self.curdom if v))
+            return _popcount(self.curdom)
 
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
-        for i in range(len(self.curdom)):
-            self.curdom[i] = True
+        self.curdom = self.full_mask
+        if self.mrv is not None:
+            self.mrv.update(self)
 
     #
     #methods for assigning and unassigning
     #
 
     def is_assigned(self):
-        return self.assignedValue != None
+        return self.assignedValue is not None
     
     def assign(self, value):
         '''Used by bt_search. When we assign we remove all other values
@@ -165,6 +250,9 @@ class Variable:
             return
 
         self.assignedValue = value
+        for c, i in self.watchers:
+            c.n_unasgn -= 1
+            c.unasgn_sum -= i
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
@@ -172,6 +260,9 @@ class Variable:
             print("ERROR: trying to unassign variable", self, " not yet assigned")
             return
         self.assignedValue = None
+        for c, i in self.watchers:
+            c.n_unasgn += 1
+            c.unasgn_sum += i
 
     def get_assigned_value(self):
         '''return assigned value...returns None if is unassigned'''
@@ -184,7 +275,7 @@ class Variable:
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        return self.val_index[value]
 
     def __repr__(self):
         return("Var-{}".format(self.name))
@@ -194,16 +285,179 @@ class Variable:
 
     def print_all(self):
         '''Also print the variable domain and current domain'''
+        flags = [(self.curdom >> i) & 1 == 1 for i in range(len(self.dom))]
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
-                                                             self.curdom))
+                                                             flags))
+class TupleTable:
+    '''Packed table of satisfying tuples. Each tuple is stored as the
+       indices of its values in the domains of the scope variables:
+       - rows: one flat array holding arity indices per tuple
+       - supports[i][x]: array of the row numbers whose i'th index is x
+       - codes: sorted array of one integer per row (the row read as a
+         mixed radix number), searched with bisect for membership
+       This takes a few bytes per tuple and position, instead of a
+       tuple object plus one list entry per position.
+
+       A table only deals in domain indices, so constraints over
+       variables with identical domains can share one frozen table
+       (see shared_table); each constraint keeps its own scope,
+       residues and weight.'''
+
+    def __init__(self, sizes):
+        '''sizes == domain size of each position'''
+        self.frozen = False
+        self.arity = len(sizes)
+        self.radix = [max(n, 1) for n in sizes]
+        self.rows = array('B')
+        self.supports = [dict() for _ in sizes]
+        self.codes = self.new_codes()
+        self.n_rows = 0
+        self.ct_masks = None
+        self.proj = dict()
+
+    def new_codes(self, values=()):
+        '''Internal routine. Codes fit a 64 bit array unless the
+           product of the radices is too large'''
+        if functools.reduce(lambda a, b: a * b, self.radix, 1) < 2 ** 63:
+            return array('q', values)
+        return list(values)
+
+    def encode(self, idx):
+        code = 0
+        for i, x in enumerate(idx):
+            code = code * self.radix[i] + x
+        return code
+
+    def row(self, r):
+        '''Indices of row r'''
+        return self.rows[r * self.arity:(r + 1) * self.arity]
+
+    def contains(self, idx):
+        '''Is the index tuple idx a row of the table'''
+        for i, x in enumerate(idx):
+            if x >= self.radix[i]:
+                return False
+        code = self.encode(idx)
+        k = bisect.bisect_left(self.codes, code)
+        return k < len(self.codes) and self.codes[k] == code
+
+    CHUNK = 1 << 16     #new codes kept aside before merging them
+
+    def add_rows(self, index_tuples):
+        '''Append the index tuples not already in the table. The codes
+           of new rows are set aside (to find duplicates among them) and
+           merged into the sorted codes every CHUNK rows, so adding a
+           large relation never holds more than a chunk of extra codes.'''
+        if self.frozen:
+            print("ERROR: trying to add tuples to a shared table")
+            return
+        pending = set()
+        for idx in index_tuples:
+            if any(x >= self.radix[i] for i, x in enumerate(idx)):
+                #a domain got larger after rows were added: widen the
+                #radices and recompute the codes
+                self.merge_codes(pending)
+                pending = set()
+                self.radix = [max(n, x + 1) for n, x in zip(self.radix, idx)]
+                self.codes = self.new_codes(sorted(self.encode(self.row(r))
+                                                   for r in range(self.n_rows)))
+            if max(idx, default=0) >= 1 << (8 * self.rows.itemsize):
+                self.rows = array('H' if max(idx) < 1 << 16 else 'I', self.rows)
+            code = self.encode(idx)
+            if code in pending or self.contains(idx):
+                continue
+            pending.add(code)
+            r = self.n_rows
+            self.rows.extend(idx)
+            for i, x in enumerate(idx):
+                sup = self.supports[i].get(x)
+                if sup is None:
+                    sup = self.supports[i][x] = array('I')
+                sup.append(r)
+            self.n_rows = r + 1
+            if len(pending) >= self.CHUNK:
+                self.merge_codes(pending)
+                pending = set()
+        self.merge_codes(pending)
+
+    def merge_codes(self, codes):
+        '''Internal routine. Merge the set codes into the sorted codes'''
+        if codes:
+            self.codes = self.new_codes(heapq.merge(self.codes, sorted(codes)))
+            self.ct_masks = None
+            self.proj = dict()
+
+    def projection(self, i, x):
+        '''For binary tables: bitmask of the indices of the other
+           position appearing in rows whose i'th index is x'''
+        key = (i, x)
+        mask = self.proj.get(key)
+        if mask is None:
+            mask = 0
+            for r in self.supports[i].get(x, ()):
+                mask |= 1 << self.rows[2 * r + 1 - i]
+            self.proj[key] = mask
+        return mask
+
+    def masks(self):
+        '''For compact tables: masks()[i][x] is the bitmask of the rows
+           whose i'th index is x'''
+        if self.ct_masks is None:
+            self.ct_masks = []
+            for sup in self.supports:
+                m = dict()
+                for x, rows in sup.items():
+                    bits = 0
+                    for r in rows:
+                        bits |= 1 << r
+                    m[x] = bits
+                self.ct_masks.append(m)
+        return self.ct_masks
+
+
+#Shared tables that are still in use, by (relation name, domains)
+_shared_tables = weakref.WeakValueDictionary()
+
+def shared_table(relation, domains, make_tuples):
+    '''Return the frozen TupleTable of the relation named relation (a
+       string, e.g., 'not-equal') over domains (one list of values for
+       each position). The table is built from the value tuples
+       returned by make_tuples() the first time it is asked for, and
+       shared until no constraint uses it any more. Pass it to the
+       Constraint constructor (or Constraint.share_table).'''
+    key = (relation, tuple(tuple(d) for d in domains))
+    table = _shared_tables.get(key)
+    if table is None:
+        table = TupleTable([len(d) for d in domains])
+        indices = []
+        for d in domains:
+            index = dict()
+            for i, val in enumerate(d):
+                index.setdefault(val, i)
+            indices.append(index)
+
+        def index_tuples():
+            for t in make_tuples():
+                try:
+                    yield tuple(indices[i][x] for i, x in enumerate(t))
+                except KeyError:
+                    pass
+
+        table.add_rows(index_tuples())
+        table.frozen = True
+        table.domains = key[1]
+        _shared_tables[key] = table
+    return table
+
+
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
        the satisfied function which tests if an assignment to the
        variables in the constraint's scope satisfies the constraint'''
 
-    def __init__(self, name, scope): 
+    def __init__(self, name, scope, table=None): 
         '''create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable objects).
         The order of the variables in the scope is critical to the
@@ -212,36 +466,88 @@ class Constraint:
         Consraints are implemented as storing a set of satisfying
         tuples (i.e., each tuple specifies a value for each variable
         in the scope such that this sequence of values satisfies the
-        constraints).
+        constraints). The tuples are packed into a TupleTable as
+        indices into the variables' domains. table is an optional
+        shared table (see share_table) to use instead of a new one.
 
-        NOTE: This is a very space expensive representation...a proper
-        constraint object would allow for representing the constraint
-        with a function.  
+        NOTE: This is a space expensive representation...see the
+        subclasses for constraints represented with a function.
         '''
 
         self.scope = list(scope)
         self.name = name
-        self.sat_tuples = dict()
-
-        #The next object data item 'sup_tuples' will be used to help
-        #support GAC propgation. It allows access to a list of 
-        #satisfying tuples that contain a particular variable/value
-        #pair.
-        self.sup_tuples = dict()
+        #position of each variable in the scope
+        self.positions = dict()
+        for i, var in enumerate(self.scope):
+            self.positions[var] = i
+        #number of unassigned variables in the scope and the sum of
+        #their positions (the position of the last one when only one
+        #is left), kept up to date by Variable.assign and unassign
+        #while the constraint is in some CSP (see watch)
+        self.n_unasgn = 0
+        self.unasgn_sum = 0
+        self.n_watching = 0     #number of CSPs the constraint is in
+        self.count_unasgn()
+        #weight is increased by the propagators each time this
+        #constraint causes a domain wipeout (used by dom/wdeg)
+        self.weight = 1
+        #times the propagators checked or revised this constraint and
+        #the values it pruned, since the last bt_start (see SearchStats)
+        self.n_revisions = 0
+        self.n_pruned = 0
+
+        #The satisfying tuples. The table also keeps, for each
+        #position and value, the row numbers of the tuples containing
+        #that value, used to help support GAC propagation.
+        self.table = None
+        if table is not None:
+            self.share_table(table)
+        if self.table is None:
+            self.table = TupleTable([var.domain_size() for var in self.scope])
+
+        #'residues' remembers the row of the last support found for
+        #each variable/value pair. It is checked before the supports
+        #are scanned again (GAC-3.1 style residual supports).
+        self.residues = dict()
+
+        #Optional compact table filtering (see use_compact_table)
+        self.compact_table = False
+        self.ct_key = None          #domain state ct_live was computed for
+        self.ct_masks = None        #table masks ct_live was computed with
+        self.ct_live = 0            #bitmask of rows valid in that state
+
+    def share_table(self, table):
+        '''Use the shared table (see shared_table) as the satisfying
+           tuples of this constraint. Its domains must be those of the
+           scope variables.'''
+        if [list(d) for d in table.domains] != [var.dom for var in self.scope]:
+            print("ERROR: shared table domains do not match the scope of", self)
+            return
+        self.table = table
+        self.residues = dict()
+        self.ct_key = None
 
     def add_satisfying_tuples(self, tuples):
-        '''We specify the constraint by adding its complete list of satisfying tuples.'''
-        for x in tuples:
-            t = tuple(x)  #ensure we have an immutable tuple
-            if not t in self.sat_tuples:
-                self.sat_tuples[t] = True
-
-            #now put t in as a support for all of the variable values in it
-            for i, val in enumerate(t):
-                var = self.scope[i]
-                if not (var,val) in self.sup_tuples:
-                    self.sup_tuples[(var,val)] = []
-                self.sup_tuples[(var,val)].append(t)
+        '''We specify the constraint by adding its complete list of satisfying tuples.
+           tuples can be any iterable, e.g., a generator: each tuple is
+           packed as soon as it is produced so the list of tuples never
+           has to exist. Tuples with a value outside a variable's domain
+           can never be satisfied and are skipped.'''
+        self.table.add_rows(self.index_tuples(tuples))
+
+    def index_tuples(self, tuples):
+        '''Internal routine. Generate the domain index tuples of tuples'''
+        indices = [var.val_index for var in self.scope]
+        for t in tuples:
+            try:
+                yield tuple(indices[i][x] for i, x in enumerate(t))
+            except KeyError:
+                pass
+
+    def satisfying_tuples(self):
+        '''Generate the satisfying tuples (as value tuples)'''
+        for r in range(self.table.n_rows):
+            yield tuple(var.dom[x] for var, x in zip(self.scope, self.table.row(r)))
 
     def get_scope(self):
         '''get list of variables the constraint is over'''
@@ -254,36 +560,133 @@ class Constraint:
            constraints "satisfies" function.  Note the list of values
            are must be ordered in the same order as the list of
            variables in the constraints scope'''
-        return tuple(vals) in self.sat_tuples
+        table = self.table
+        code = 0
+        for var, x, n in zip(self.scope, vals, table.radix):
+            i = var.val_index.get(x)
+            if i is None or i >= n:
+                return False
+            code = code * n + i
+        codes = table.codes
+        k = bisect.bisect_left(codes, code)
+        return k < len(codes) and codes[k] == code
+
+    def count_unasgn(self):
+        '''Internal routine. Set n_unasgn and unasgn_sum from the scope'''
+        self.n_unasgn = 0
+        self.unasgn_sum = 0
+        for i, var in enumerate(self.scope):
+            if not var.is_assigned():
+                self.n_unasgn += 1
+                self.unasgn_sum += i
+
+    def watch(self):
+        '''Internal routine, called when the constraint is added to a
+           CSP: the scope variables keep its counts of unassigned
+           variables up to date from now on'''
+        if self.n_watching == 0:
+            self.count_unasgn()
+            for i, var in enumerate(self.scope):
+                var.watchers.append((self, i))
+        self.n_watching += 1
+
+    def unwatch(self):
+        '''Internal routine, called when the constraint is removed from
+           a CSP: the scope variables forget it once it is in no CSP'''
+        self.n_watching -= 1
+        if self.n_watching == 0:
+            for i, var in enumerate(self.scope):
+                var.watchers.remove((self, i))
 
     def get_n_unasgn(self):
         '''return the number of unassigned variables in the constraint's scope'''
-        n = 0
-        for v in self.scope:
-            if not v.is_assigned():
-                n = n + 1
-        return n
+        if not self.n_watching:
+            self.count_unasgn()
+        return self.n_unasgn
 
     def get_unasgn_vars(self): 
         '''return list of unassigned variables in constraint's scope. Note
-           more expensive to get the list than to then number'''
+           more expensive to get the list than to then number (unless
+           there is only one)'''
+        if not self.n_watching:
+            self.count_unasgn()
+        if self.n_unasgn == 1:
+            return [self.scope[self.unasgn_sum]]
         vs = []
         for v in self.scope:
             if not v.is_assigned():
                 vs.append(v)
         return vs
 
+    def use_compact_table(self, on=True):
+        '''Turn compact table support checking on or off. With it on,
+           each position/value of the table gets a bitmask of the rows
+           containing it. has_support then ANDs/ORs these masks to find
+           the still valid rows once per domain state, instead of
+           checking rows one by one. Worth it for constraints with large
+           tables.'''
+        self.compact_table = on
+        self.ct_key = None
+
     def has_support(self, var, val):
         '''Test if a variable value pair has a supporting tuple (a set
            of assignments satisfying the constraint where each value is
            still in the corresponding variables current domain
         '''
-        if (var, val) in self.sup_tuples:
-            for t in self.sup_tuples[(var, val)]:
-                if self.tuple_is_valid(t):
-                    return True
+        r = self.residues.get((var, val))
+        if r is not None and self.row_is_valid(r):
+            return True
+        if self.compact_table:
+            return self.ct_has_support(var, val)
+        i = var.val_index.get(val)
+        if i is None:
+            return False
+        for r in self.table.supports[self.positions[var]].get(i, ()):
+            if self.row_is_valid(r):
+                self.residues[(var, val)] = r
+                return True
         return False
 
+    def ct_has_support(self, var, val):
+        '''Internal routine. has_support using the compact table'''
+        masks = self.table.masks()
+
+        #recompute the valid rows only when some domain has changed
+        key = tuple(v.cur_domain_mask() for v in self.scope)
+        if key != self.ct_key or masks is not self.ct_masks:
+            live = -1
+            for i, m in enumerate(key):
+                mask = 0
+                while m:
+                    low = m & -m
+                    mask |= masks[i].get(low.bit_length() - 1, 0)
+                    m ^= low
+                live &= mask
+                if not live:
+                    break
+            self.ct_key = key
+            self.ct_masks = masks
+            self.ct_live = live
+
+        i = var.val_index.get(val)
+        if i is None:
+            return False
+        found = self.ct_live & masks[self.positions[var]].get(i, 0)
+        if found:
+            #remember it as the residue, the lowest valid row will do
+            self.residues[(var, val)] = (found & -found).bit_length() - 1
+            return True
+        return False
+
+    def row_is_valid(self, r):
+        '''Internal routine. Check if every value in row r of the table
+           is still in the corresponding variable's current domain'''
+        row = self.table.row(r)
+        for i, var in enumerate(self.scope):
+            if not (var.cur_domain_mask() >> row[i]) & 1:
+                return False
+        return True
+
     def tuple_is_valid(self, t):
         '''Internal routine. Check if every value in tuple is still in
            corresponding variable domains'''
@@ -292,14 +695,613 @@ class Constraint:
                 return False
         return True
 
+    #
+    #propagator hooks. Subclasses override these with filtering
+    #specific to the constraint.
+    #
+
+    def revise(self, pruned):
+        '''Used by GAC. Prune every value of the scope variables that has
+           no support, appending the (Variable, value) pairs pruned to
+           pruned. Returns the list of variables whose domain changed,
+           or None if a domain was wiped out (an assigned variable
+           losing its value counts as a wipeout).'''
+        changed = []
+        for var in self.scope:
+            var_changed = False
+            for val in var.cur_domain():
+                if not self.has_support(var, val):
+                    var.prune_value(val)
+                    pruned.append((var, val))
+                    var_changed = True
+                    if var.is_assigned() or not var.cur_domain_size():
+                        return None
+            if var_changed:
+                changed.append(var)
+        return changed
+
+    def forward_check(self, var, pruned):
+        '''Used by forward checking. var is the only unassigned variable
+           in the scope: prune each of its values that does not satisfy
+           the constraint together with the assigned values, appending
+           the pairs pruned to pruned. Returns False on a wipeout.
+
+           The rows containing the assigned value with the fewest
+           supports are scanned, and var keeps the values of the rows
+           that agree with every assigned value.'''
+        table = self.table
+        pos = self.positions[var]
+        if table.arity == 1:
+            #every row is an allowed value of var
+            allowed = 0
+            for x in table.supports[0]:
+                allowed |= 1 << x
+        elif table.arity == 2:
+            other = self.scope[1 - pos]
+            allowed = table.projection(1 - pos, other.cur_domain_mask().bit_length() - 1)
+        else:
+            idx = [v.cur_domain_mask().bit_length() - 1 for v in self.scope]
+            rows = None
+            for i, x in enumerate(idx):
+                if i != pos:
+                    sup = table.supports[i].get(x, ())
+                    if rows is None or len(sup) < len(rows):
+                        rows = sup
+                        best = i
+            allowed = 0
+            flat = table.rows
+            k = table.arity
+            check = [i for i in range(k) if i != pos and i != best]
+            for r in rows:
+                base = r * k
+                for i in check:
+                    if flat[base + i] != idx[i]:
+                        break
+                else:
+                    allowed |= 1 << flat[base + pos]
+
+        remove = var.curdom & ~allowed
+        while remove:
+            low = remove & -remove
+            val = var.dom[low.bit_length() - 1]
+            var.prune_value(val)
+            pruned.append((var, val))
+            remove ^= low
+        return var.cur_domain_size() > 0
+
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
+
+class FunctionConstraint(Constraint):
+    '''Constraint defined intensionally by a predicate. predicate is
+       called with a list of values, one for each variable of the
+       scope (in scope order), and returns True if they satisfy the
+       constraint. No tuples are stored; supports are found by
+       searching the current domains and remembered as residues.'''
+
+    def __init__(self, name, scope, predicate):
+        Constraint.__init__(self, name, scope)
+        self.predicate = predicate
+        #reused by forward_check for the values passed to predicate
+        self.values = [None] * len(self.scope)
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: constraint", self, "is defined by a function, not by tuples")
+
+    def check(self, vals):
+        return bool(self.predicate(list(vals)))
+
+    def has_support(self, var, val):
+        t = self.residues.get((var, val))
+        if t is not None and self.tuple_is_valid(t):
+            return True
+        t = self.find_support(var, val)
+        if t is None:
+            return False
+        self.residues[(var, val)] = t
+        return True
+
+    def find_support(self, var, val):
+        '''Return a tuple of current domain values with var = val
+           satisfying the constraint, or None. Generic enumeration,
+           subclasses search more cleverly.'''
+        domains = [[val] if v is var else v.cur_domain() for v in self.scope]
+        for t in itertools.product(*domains):
+            if self.predicate(list(t)):
+                return t
+        return None
+
+    def forward_check(self, var, pruned):
+        '''Call predicate for each value of var with the assigned values
+           of the other variables. One list is filled in and passed to
+           every call (so predicate must not keep or change it).'''
+        values = self.values
+        for i, v in enumerate(self.scope):
+            values[i] = v.assignedValue
+        pos = self.positions[var]
+        predicate = self.predicate
+        dom = var.dom
+        mask = var.curdom
+        while mask:
+            low = mask & -mask
+            val = dom[low.bit_length() - 1]
+            values[pos] = val
+            if not predicate(values):
+                var.prune_value(val)
+                pruned.append((var, val))
+            mask ^= low
+        return var.cur_domain_size() > 0
+
+
+class NotEqualConstraint(FunctionConstraint):
+    '''Binary constraint scope[0] != scope[1]'''
+
+    def __init__(self, name, scope):
+        FunctionConstraint.__init__(self, name, scope, lambda vals: vals[0] != vals[1])
+
+    def check(self, vals):
+        return vals[0] != vals[1]
+
+    def find_support(self, var, val):
+        other = self.scope[1] if var is self.scope[0] else self.scope[0]
+        for x in other.cur_domain():
+            if x != val:
+                return (val, x) if var is self.scope[0] else (x, val)
+        return None
+
+    def revise(self, pruned):
+        changed = []
+        for var, other in ((self.scope[0], self.scope[1]), (self.scope[1], self.scope[0])):
+            if other.cur_domain_size() == 1:
+                #other is fixed, its value can't be used by var
+                val = other.cur_domain()[0]
+                if var.in_cur_domain(val):
+                    var.prune_value(val)
+                    pruned.append((var, val))
+                    if var.is_assigned() or not var.cur_domain_size():
+                        return None
+                    changed.append(var)
+        return changed
+
+    def forward_check(self, var, pruned):
+        other = self.scope[1] if var is self.scope[0] else self.scope[0]
+        val = other.get_assigned_value()
+        if var.in_cur_domain(val):
+            var.prune_value(val)
+            pruned.append((var, val))
+        return var.cur_domain_size() > 0
+
+
+class AllDiffConstraint(FunctionConstraint):
+    '''All variables of the scope take different values. revise
+       enforces
+
+       consistency == 'gac':   GAC with Regin's algorithm. A maximum
+                    matching of variables to values is kept (and reused
+                    between calls); a value is pruned unless its edge is
+                    in the matching, on an alternating cycle, or on an
+                    alternating path from a free value.
+       consistency == 'value': value elimination only: the value of a
+                    variable with a single value left is removed from
+                    the other variables.
+    '''
+
+    def __init__(self, name, scope, consistency='gac'):
+        FunctionConstraint.__init__(self, name, scope, lambda vals: len(set(vals)) == len(vals))
+        if not consistency in ['gac', 'value']:
+            print("Unknown consistency", consistency, "for", self, "using 'gac'")
+            consistency = 'gac'
+        self.consistency = consistency
+        self.matching = dict()      #variable --> value, kept between calls
+
+    def check(self, vals):
+        return len(set(vals)) == len(vals)
+
+    def max_matching(self, domains, matching):
+        '''Internal routine. Extend matching (variable --> value, every
+           value in the variable's domain) to a maximum matching of the
+           variables in domains with augmenting paths. Returns the
+           matching and the value --> variable inverse.'''
+        owner = dict()
+        for var, val in matching.items():
+            owner[val] = var
+
+        for root in domains:
+            if root in matching:
+                continue
+            #breadth first search for an augmenting path from root
+            parent = {root: None}
+            frontier = [root]
+            end = None
+            while frontier and end is None:
+                nxt = []
+                for var in frontier:
+                    for val in domains[var]:
+                        if ('val', val) in parent:
+                            continue
+                        parent[('val', val)] = var
+                        if not val in owner:
+                            end = val
+                            break
+                        parent[owner[val]] = ('val', val)
+                        nxt.append(owner[val])
+                    if end is not None:
+                        break
+                frontier = nxt
+            if end is None:
+                continue
+            #flip the path
+            val = end
+            while True:
+                var = parent[('val', val)]
+                prev = matching.get(var)
+                matching[var] = val
+                owner[val] = var
+                if var is root:
+                    break
+                val = prev
+        return matching, owner
+
+    def revise(self, pruned):
+        if self.consistency == 'value':
+            return self.revise_value(pruned)
+        return self.revise_gac(pruned)
+
+    def revise_gac(self, pruned):
+        '''Regin's filtering, see the class description'''
+        domains = dict()
+        for var in self.scope:
+            domains[var] = var.cur_domain()
+
+        #drop matched values that are no longer current, then repair
+        matching = dict()
+        for var, val in self.matching.items():
+            if var in domains and val in domains[var]:
+                matching[var] = val
+        matching, owner = self.max_matching(domains, matching)
+        self.matching = matching
+        if len(matching) < len(self.scope):
+            return None
+
+        #Directed graph: variable --> its matched value, value --> every
+        #variable it is an unmatched candidate for. Nodes are variables
+        #and ('val', value) pairs.
+        succ = dict()
+        for var in self.scope:
+            succ[var] = [('val', matching[var])]
+            for val in domains[var]:
+                if val != matching[var]:
+                    succ.setdefault(('val', val), []).append(var)
+                else:
+                    succ.setdefault(('val', val), [])
+
+        #values reachable from a free value lie on even alternating paths
+        reached = set()
+        stack = [node for node in succ if type(node) is tuple and not node[1] in owner]
+        reached.update(stack)
+        while stack:
+            node = stack.pop()
+            for nxt in succ[node]:
+                if not nxt in reached:
+                    reached.add(nxt)
+                    stack.append(nxt)
+
+        component = _strongly_connected(succ)
+
+        changed = []
+        for var in self.scope:
+            var_changed = False
+            for val in domains[var]:
+                if val == matching[var]:
+                    continue
+                node = ('val', val)
+                if node in reached or component[node] == component[var]:
+                    continue
+                var.prune_value(val)
+                pruned.append((var, val))
+                var_changed = True
+            if var_changed:
+                changed.append(var)
+        return changed
+
+    def revise_value(self, pruned):
+        '''Value elimination: the value of a variable with a single
+           value left is removed from all other variables, until no
+           more variables become fixed.'''
+        changed = []
+        fixed = [v for v in self.scope if v.cur_domain_size() == 1]
+        done = set()
+        while fixed:
+            fv = fixed.pop()
+            if fv in done:
+                continue
+            done.add(fv)
+            val = fv.cur_domain()[0]
+            for var in self.scope:
+                if var is not fv and var.in_cur_domain(val):
+                    var.prune_value(val)
+                    pruned.append((var, val))
+                    if var.is_assigned() or not var.cur_domain_size():
+                        return None
+                    if not var in changed:
+                        changed.append(var)
+                    if var.cur_domain_size() == 1:
+                        fixed.append(var)
+        return changed
+
+    def find_support(self, var, val):
+        '''Match the other variables to values different from val'''
+        domains = dict()
+        for v in self.scope:
+            if v is not var:
+                domains[v] = [x for x in v.cur_domain() if x != val]
+        matching, _ = self.max_matching(domains, dict())
+        if len(matching) < len(domains):
+            return None
+        matching[var] = val
+        return tuple(matching[v] for v in self.scope)
+
+    def forward_check(self, var, pruned):
+        '''The assigned variables must have different values, and var
+           loses their values'''
+        seen = set()
+        for v in self.scope:
+            if v is not var:
+                val = v.get_assigned_value()
+                if val in seen:
+                    return False
+                seen.add(val)
+                if var.in_cur_domain(val):
+                    var.prune_value(val)
+                    pruned.append((var, val))
+        return var.cur_domain_size() > 0
+
+
+def _strongly_connected(succ):
+    '''Return a dictionary mapping each node of the directed graph succ
+       (node --> list of successor nodes) to the number of its strongly
+       connected component. Iterative Tarjan, so large graphs do not
+       hit the recursion limit.'''
+    index = dict()
+    low = dict()
+    component = dict()
+    on_stack = set()
+    stack = []
+    n = 0
+    n_components = 0
+    for start in succ:
+        if start in index:
+            continue
+        work = [(start, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = n
+                n = n + 1
+                stack.append(node)
+                on_stack.add(node)
+            recurse = False
+            edges = succ[node]
+            while i < len(edges):
+                nxt = edges[i]
+                i = i + 1
+                if not nxt in index:
+                    work.append((node, i))
+                    work.append((nxt, 0))
+                    recurse = True
+                    break
+                elif nxt in on_stack:
+                    low[node] = min(low[node], index[nxt])
+            if recurse:
+                continue
+            if low[node] == index[node]:
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    component[w] = n_components
+                    if w == node:
+                        break
+                n_components = n_components + 1
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return component
+
+
+class LinearConstraint(FunctionConstraint):
+    '''Linear equation sum(coefficients[i] * scope[i]) == total over
+       numeric variables. revise enforces
+
+       consistency == 'bounds': bounds consistency. The smallest and
+                      largest value of each term are summed once, and
+                      each variable keeps only the values that fit
+                      between total minus the other terms' largest and
+                      smallest sums. The domains are read once, then
+                      O(arity) per pass plus the values removed,
+                      repeated until the bounds stop moving.
+       consistency == 'domain': domain consistency (GAC), by dynamic
+                      programming over the sets of reachable partial sums
+                      from the left and from the right of the scope.
+    '''
+
+    def __init__(self, name, scope, coefficients, total, consistency='bounds'):
+        FunctionConstraint.__init__(self, name, scope, self.check)
+        self.coefficients = list(coefficients)
+        self.total = total
+        if not consistency in ['bounds', 'domain']:
+            print("Unknown consistency", consistency, "for", self, "using 'bounds'")
+            consistency = 'bounds'
+        self.consistency = consistency
+
+    def set_total(self, total):
+        '''Change the right hand side, e.g., to reuse a model for
+           another instance. Remembered supports are dropped as they
+           were found for the old total.'''
+        self.total = total
+        self.residues = dict()
+
+    def check(self, vals):
+        return sum(a * x for a, x in zip(self.coefficients, vals)) == self.total
+
+    def term_bounds(self, i, vals):
+        '''Internal routine. smallest and largest value of the i'th term'''
+        a = self.coefficients[i]
+        if a >= 0:
+            return a * min(vals), a * max(vals)
+        return a * max(vals), a * min(vals)
+
+    def revise(self, pruned):
+        if self.consistency == 'domain':
+            return self.revise_domain(pruned)
+        return self.revise_bounds(pruned)
+
+    def revise_bounds(self, pruned):
+        '''Bounds consistency, see the class description. The domains
+           and term bounds are read once. Each pass narrows every term
+           against the running sums lo and hi, which only ever tighten,
+           and passes are repeated until one prunes nothing.'''
+        changed = []
+        n = len(self.scope)
+        domains = [v.cur_domain() for v in self.scope]
+        bounds = [self.term_bounds(i, domains[i]) for i in range(n)]
+        lo = sum(b[0] for b in bounds)
+        hi = sum(b[1] for b in bounds)
+        moved = True
+        while moved:
+            moved = False
+            if lo > self.total or hi < self.total:
+                return None
+            for i, var in enumerate(self.scope):
+                #the i'th term must lie within [tlo, thi]
+                blo, bhi = bounds[i]
+                tlo = self.total - (hi - bhi)
+                thi = self.total - (lo - blo)
+                if blo >= tlo and bhi <= thi:
+                    continue
+                a = self.coefficients[i]
+                keep = []
+                for val in domains[i]:
+                    if a * val < tlo or a * val > thi:
+                        var.prune_value(val)
+                        pruned.append((var, val))
+                    else:
+                        keep.append(val)
+                if var.is_assigned() or not keep:
+                    return None
+                if not var in changed:
+                    changed.append(var)
+                domains[i] = keep
+                bounds[i] = self.term_bounds(i, keep)
+                lo = lo + bounds[i][0] - blo
+                hi = hi + bounds[i][1] - bhi
+                moved = True
+        return changed
+
+    def revise_domain(self, pruned):
+        '''Domain consistency by dynamic programming over partial sums'''
+        n = len(self.scope)
+        domains = [v.cur_domain() for v in self.scope]
+        #left[i] = sums reachable by terms 0..i-1
+        left = [set([0])]
+        for i in range(n):
+            a = self.coefficients[i]
+            left.append(set(s + a * x for s in left[i] for x in domains[i]))
+        if not self.total in left[n]:
+            return None
+        #right[i] = sums reachable by terms i..n-1
+        right = [None] * (n + 1)
+        right[n] = set([0])
+        for i in range(n - 1, -1, -1):
+            a = self.coefficients[i]
+            right[i] = set(s + a * x for s in right[i + 1] for x in domains[i])
+
+        changed = []
+        for i, var in enumerate(self.scope):
+            a = self.coefficients[i]
+            var_changed = False
+            for val in domains[i]:
+                rest = self.total - a * val
+                if not any(rest - s in right[i + 1] for s in left[i]):
+                    var.prune_value(val)
+                    pruned.append((var, val))
+                    if var.is_assigned() or not var.cur_domain_size():
+                        return None
+                    var_changed = True
+            if var_changed:
+                changed.append(var)
+        return changed
+
+    def find_support(self, var, val):
+        '''Depth first search over the other variables, cutting off
+           branches whose remaining minimum/maximum can't reach total'''
+        others = [i for i, v in enumerate(self.scope) if v is not var]
+        domains = [sorted(self.scope[i].cur_domain()) for i in others]
+        if not all(domains):
+            return None
+        #lo[k]/hi[k] = smallest/largest sum of the terms others[k:]
+        lo = [0] * (len(others) + 1)
+        hi = [0] * (len(others) + 1)
+        for k in range(len(others) - 1, -1, -1):
+            tlo, thi = self.term_bounds(others[k], domains[k])
+            lo[k] = lo[k + 1] + tlo
+            hi[k] = hi[k + 1] + thi
+        found = {var: val}
+
+        def extend(k, rest):
+            if rest < lo[k] or rest > hi[k]:
+                return False
+            if k == len(others):
+                return True
+            a = self.coefficients[others[k]]
+            for x in domains[k]:
+                found[self.scope[others[k]]] = x
+                if extend(k + 1, rest - a * x):
+                    return True
+            return False
+
+        if extend(0, self.total - self.coefficients[self.scope.index(var)] * val):
+            return tuple(found[v] for v in self.scope)
+        return None
+
+    def forward_check(self, var, pruned):
+        need = self.total
+        a = 0
+        for i, v in enumerate(self.scope):
+            if v is var:
+                a = self.coefficients[i]
+            else:
+                need = need - self.coefficients[i] * v.get_assigned_value()
+        for val in var.cur_domain():
+            if a * val != need:
+                var.prune_value(val)
+                pruned.append((var, val))
+        return var.cur_domain_size() > 0
+
+
+class SumConstraint(LinearConstraint):
+    '''The values of the scope variables (numbers) sum to total'''
+
+    def __init__(self, name, scope, total, consistency='bounds'):
+        LinearConstraint.__init__(self, name, scope, [1] * len(scope), total, consistency)
+
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
        The variables of the CSP can be added later or on initialization.
-       The constraints must be added later'''
+       The constraints must be added later
+
+       Changes can be made in scopes: push opens a scope and pop undoes
+       every constraint added or removed and every assignment added
+       (add_assignment) since the matching push, so a problem can be
+       changed and solved again without being rebuilt. Within scopes
+       bt_search remembers the domains left by its root propagation,
+       and later searches in the same or inner scopes start from them
+       (unless a constraint was removed in between).
+
+       Symmetries of the problem can be declared with add_symmetry, so
+       that search (see BT.symmetry_on) skips symmetric variants.'''
 
     def __init__(self, name, vars=[]):
         '''create a CSP object. Specify a name (a string) and 
@@ -309,6 +1311,9 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        self.assignments = []   #(var, value) pairs bt_search must respect
+        self.scopes = []        #see push
+        self.symmetries = []    #see add_symmetry
         for v in vars:
             self.add_var(v)
 
@@ -326,7 +1331,7 @@ class CSP:
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -335,6 +1340,113 @@ class CSP:
                     return
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
+            c.watch()
+            if self.scopes:
+                self.scopes[-1]['log'].append(('add', c))
+
+    def remove_constraint(self, c):
+        '''Remove constraint c from the CSP'''
+        if not c in self.cons:
+            print("Trying to remove constraint ", c, " that is not in CSP object")
+            return
+        where = (self.cons.index(c), [self.vars_to_cons[v].index(c) for v in c.scope])
+        del self.cons[where[0]]
+        for v, i in zip(c.scope, where[1]):
+            del self.vars_to_cons[v][i]
+        c.unwatch()
+        if self.scopes:
+            scope = self.scopes[-1]
+            scope['log'].append(('remove', c, where))
+            #values pruned because of c may be consistent again
+            scope['root'] = None
+            scope['removed'] = True
+
+    def add_assignment(self, var, value):
+        '''Make every search assign value to var (until the scope is
+           popped). bt_search restricts var's domain to value before
+           propagating at the root.'''
+        if not var in self.vars_to_cons:
+            print("Trying to assign variable ", var, " that is not in CSP object")
+        elif not value in var.domain():
+            print("ERROR: trying to assign variable", var, "illegal value", value)
+        else:
+            self.assignments.append((var, value))
+            if self.scopes:
+                self.scopes[-1]['log'].append(('assign',))
+
+    def get_assignments(self):
+        '''return list of (Variable, value) pairs added by add_assignment'''
+        return list(self.assignments)
+
+    def add_symmetry(self, symmetry):
+        '''Declare a symmetry of the CSP: a function mapping each
+           (Variable, value) pair to a (Variable, value) pair, one to one,
+           such that the images of the assignments of every solution
+           form a solution. Every element of the symmetry group except
+           the identity must be added (e.g., the 7 rotations and
+           reflections of an n-queens board), and they must respect the
+           add_assignment values.
+
+           Searches with BT.symmetry_on then keep only the lex leader of
+           each class of symmetric solutions: the one whose values (by
+           their position in the domains, in the order of the CSP's
+           variables) are lexicographically smallest.'''
+        self.symmetries.append(symmetry)
+        if self.scopes:
+            self.scopes[-1]['log'].append(('symmetry',))
+
+    def get_symmetries(self):
+        '''return list of symmetries added by add_symmetry'''
+        return list(self.symmetries)
+
+    def push(self):
+        '''Open a new scope'''
+        self.scopes.append({'log': [],         #changes made in the scope
+                            'root': None,      #domains after root propagation
+                            'removed': False}) #a constraint was removed
+
+    def pop(self):
+        '''Close the innermost scope, undoing its changes'''
+        if not self.scopes:
+            print("ERROR: pop without a matching push on CSP", self.name)
+            return
+        for change in reversed(self.scopes.pop()['log']):
+            if change[0] == 'add':
+                c = change[1]
+                self.cons.pop()
+                for v in c.scope:
+                    self.vars_to_cons[v].pop()
+                c.unwatch()
+            elif change[0] == 'remove':
+                c, (i, where) = change[1], change[2]
+                self.cons.insert(i, c)
+                for v, j in zip(c.scope, where):
+                    self.vars_to_cons[v].insert(j, c)
+                c.watch()
+            elif change[0] == 'symmetry':
+                self.symmetries.pop()
+            else:
+                self.assignments.pop()
+
+    def scope_depth(self):
+        '''Number of open scopes'''
+        return len(self.scopes)
+
+    def get_root_state(self):
+        '''Internal routine. Domains (var --> bitmask) left by a root
+           propagation whose removed values are still in no solution of
+           the CSP as it is now, or None'''
+        for scope in reversed(self.scopes):
+            if scope['root'] is not None:
+                return scope['root']
+            if scope['removed']:
+                break
+        return None
+
+    def set_root_state(self, domains):
+        '''Internal routine. Remember the domains left by root propagation'''
+        if self.scopes:
+            self.scopes[-1]['root'] = domains
 
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
@@ -364,6 +1476,309 @@ class CSP:
 # Backtracking Routine                                 #
 ########################################################
 
+class NogoodStore:
+    '''Learned nogoods. A nogood is a list of literals (Variable, value)
+       that must not all hold at once, i.e., not every variable may be
+       assigned its value. Each nogood watches two of its literals (the
+       first two of the list). Only assigning a watched literal's value
+       makes the store look at the nogood: it then watches another
+       literal that does not hold, or, if every other literal holds,
+       prunes the value of the last one (or reports a conflict if it
+       holds too). Watches need no undoing on backtrack.'''
+
+    def __init__(self, max_size=20):
+        '''max_size == longest nogood that is kept'''
+        self.max_size = max_size
+        self.watches = dict()   #(Variable, value) --> nogoods watching it
+        self.n_nogoods = 0
+
+    def add(self, literals):
+        '''Add a nogood. literals should be ordered so the ones that
+           will be undone first (deepest search levels) come first.'''
+        if not literals or len(literals) > self.max_size:
+            return
+        ng = list(literals)
+        for lit in ng[:2]:
+            self.watches.setdefault(lit, []).append(ng)
+        self.n_nogoods = self.n_nogoods + 1
+
+    def propagate(self, var, val):
+        '''var has just been assigned val. Returns (conflict, units):
+           conflict is a nogood whose literals all hold (or None), units
+           is a list of (literal, nogood) where the literal's value must
+           be pruned because all the nogood's other literals hold.'''
+        units = []
+        watching = self.watches.get((var, val))
+        if not watching:
+            return None, units
+        lit = (var, val)
+        for ng in list(watching):
+            if ng[0] != lit:
+                ng[0], ng[1] = ng[1], ng[0]
+            #look for a literal that does not hold to watch instead
+            for k in range(2, len(ng)):
+                v, x = ng[k]
+                if v.get_assigned_value() != x:
+                    ng[0], ng[k] = ng[k], ng[0]
+                    watching.remove(ng)
+                    self.watches.setdefault(ng[0], []).append(ng)
+                    break
+            else:
+                if len(ng) == 1:
+                    return ng, units
+                v, x = ng[1]
+                if v.get_assigned_value() == x:
+                    return ng, units
+                if not v.is_assigned() and v.in_cur_domain(x):
+                    units.append((ng[1], ng))
+        return None, units
+
+
+class Trail:
+    '''Undo stack for variable domains. Each search level is opened
+       with push_level. The first time a variable attached to the
+       trail (var.trail = trail) changes its current domain on a
+       level, the old bitmask is saved. pop_level puts back the saved
+       bitmasks of the newest level, so the cost of backtracking is
+       the number of variables changed on that level, not the number
+       of values pruned.'''
+
+    def __init__(self):
+        self.entries = []   #(variable, saved curdom) pairs
+        self.marks = []     #(len(entries), stamp) for each open level
+        self.n_stamps = 0
+        self.stamp = 0      #identifies the newest level
+
+    def push_level(self):
+        '''Start a new level'''
+        self.marks.append((len(self.entries), self.stamp))
+        self.n_stamps = self.n_stamps + 1
+        self.stamp = self.n_stamps
+
+    def save(self, var):
+        '''Record var's current domain before its first change on this level'''
+        self.entries.append((var, var.curdom))
+        var.trail_stamp = self.stamp
+
+    def pop_level(self):
+        '''Undo every domain change made since the matching push_level'''
+        mark, self.stamp = self.marks.pop()
+        entries = self.entries
+        while len(entries) > mark:
+            var, curdom = entries.pop()
+            var.curdom = curdom
+            if var.mrv is not None:
+                var.mrv.update(var)
+
+    def depth(self):
+        '''Number of open levels'''
+        return len(self.marks)
+
+
+class MRVBuckets:
+    '''Unassigned variables bucketed by current domain size.
+       Variables attached to the buckets (var.mrv = buckets) report
+       every change of their current domain, so extract can take the
+       first non empty bucket instead of recomputing every domain
+       size. Ties are broken by the smallest key in ties (see
+       BT.set_tie_break).
+
+       Each bucket is a heap of (tie key, number, variable) entries, so
+       extract pops the best variable of a bucket in O(log(bucket))
+       instead of scanning it. A variable leaving a bucket leaves its
+       entry behind; entries are only trusted if where still puts the
+       variable in that bucket, and the heaps are rebuilt once the
+       stale entries outnumber the variables.'''
+
+    def __init__(self, ties):
+        '''ties == dictionary mapping each variable to its tie breaking key'''
+        self.ties = ties
+        self.buckets = [[]]       #buckets[k] = heap of variables with k values left
+        self.where = dict()       #variable --> index of its bucket
+        self.number = dict()      #variable --> number, orders equal keys
+        self.entries = 0          #entries in the heaps, stale ones included
+
+    def __len__(self):
+        return len(self.where)
+
+    def push(self, var, size):
+        '''Internal routine. Put var in the bucket size'''
+        while len(self.buckets) <= size:
+            self.buckets.append([])
+        n = self.number.get(var)
+        if n is None:
+            n = self.number[var] = len(self.number)
+        heapq.heappush(self.buckets[size], (self.ties[var], n, var))
+        self.where[var] = size
+        self.entries += 1
+        if self.entries > 2 * len(self.where) + 64:
+            self.rebuild()
+
+    def rebuild(self):
+        '''Drop the stale entries, and reorder the buckets after the
+           keys in ties have changed'''
+        self.buckets = [[] for _ in self.buckets]
+        for var, size in self.where.items():
+            self.buckets[size].append((self.ties[var], self.number[var], var))
+        for bucket in self.buckets:
+            heapq.heapify(bucket)
+        self.entries = len(self.where)
+
+    def add(self, var):
+        '''Insert an unassigned variable'''
+        self.push(var, _popcount(var.curdom))
+        var.mrv = self
+
+    def update(self, var):
+        '''Move var to the bucket matching its current domain size'''
+        old = self.where.get(var)
+        if old is None:
+            return
+        size = _popcount(var.curdom)
+        if size != old:
+            self.push(var, size)
+
+    def members(self, size):
+        '''List of the variables with size values left'''
+        where = self.where
+        vs = []
+        if size < len(self.buckets):
+            for entry in self.buckets[size]:
+                var = entry[2]
+                if where.get(var) == size and not var in vs:
+                    vs.append(var)
+        return vs
+
+    def extract(self):
+        '''Remove and return the variable with minimum current domain'''
+        where = self.where
+        for size, bucket in enumerate(self.buckets):
+            while bucket:
+                var = heapq.heappop(bucket)[2]
+                self.entries -= 1
+                if where.get(var) == size:
+                    del where[var]
+                    var.mrv = None
+                    return var
+        return None
+
+    def remove(self, var):
+        '''Remove the unassigned variable var'''
+        del self.where[var]
+        var.mrv = None
+
+    def clear(self):
+        '''Detach all remaining variables'''
+        for var in self.where:
+            var.mrv = None
+        self.where = dict()
+        self.buckets = [[]]
+        self.entries = 0
+
+
+class SearchStats:
+    '''Statistics of one bt_search (or bt_solutions enumeration):
+
+       solved              True/False once the search is over
+       runtime             CPU seconds of the search
+       first_solution_time CPU seconds until the first solution (or None)
+       propagator_time     seconds (wall clock) spent in the propagator
+       propagator_calls    number of propagator calls (including
+                           those made by the preprocessing pass)
+       preprocess_time     CPU seconds of the preprocessing pass
+       preprocess_pruned   values it removed (see BT.set_preprocessing)
+       nDecisions, nPrunings, nFails, nBackjumps, nRestarts
+                           the counters of BT (see BT.print_stats)
+       backtracks          times all values of a variable failed and
+                           search went back to the previous variable
+       depth_histogram     depth_histogram[d] is the number of variable
+                           assignments made at depth d (from 1)
+       constraints         list of (constraint, revisions, prunings):
+                           how often the propagators checked or revised
+                           each constraint and the values it pruned'''
+
+    def __init__(self):
+        self.solved = None
+        self.start = time.process_time()
+        self.runtime = 0
+        self.first_solution_time = None
+        self.propagator_time = 0.0
+        self.propagator_calls = 0
+        self.preprocess_time = 0
+        self.preprocess_pruned = 0
+        self.nDecisions = 0
+        self.nPrunings = 0
+        self.nFails = 0
+        self.nBackjumps = 0
+        self.nRestarts = 0
+        self.backtracks = 0
+        self.depth_histogram = [0]
+        self.constraints = []
+
+    def decision(self, depth):
+        '''Count a variable assignment made at depth'''
+        hist = self.depth_histogram
+        while len(hist) <= depth:
+            hist.append(0)
+        hist[depth] = hist[depth] + 1
+
+    def solution(self):
+        '''Note the time of the first solution'''
+        if self.first_solution_time is None:
+            self.first_solution_time = time.process_time() - self.start
+
+    def finish(self, solver, status):
+        '''Copy the counters of the BT object solver and of its CSP's
+           constraints at the end of the search'''
+        self.solved = status
+        self.runtime = time.process_time() - self.start
+        self.nDecisions = solver.nDecisions
+        self.nPrunings = solver.nPrunings
+        self.nFails = solver.nFails
+        self.nBackjumps = solver.nBackjumps
+        self.nRestarts = solver.nRestarts
+        self.constraints = [(c, c.n_revisions, c.n_pruned)
+                            for c in solver.csp.get_all_cons()]
+
+    def busiest_constraints(self, n=10):
+        '''The n constraints revised most often, with their counts'''
+        return sorted(self.constraints, key=lambda x: -x[1])[:n]
+
+    def idle_constraints(self):
+        '''Constraints that were revised but never pruned a value'''
+        return [c for c, revisions, pruned in self.constraints
+                if revisions and not pruned]
+
+    def print_report(self, n=10):
+        print("Search {} in {:.3f}s, first solution after {}".format(
+            "succeeded" if self.solved else "failed", self.runtime,
+            "-" if self.first_solution_time is None
+            else "{:.3f}s".format(self.first_solution_time)))
+        print("  {} decisions, {} prunings, {} failures, {} backtracks, {} restarts, {} backjumps".format(
+            self.nDecisions, self.nPrunings, self.nFails, self.backtracks,
+            self.nRestarts, self.nBackjumps))
+        print("  {} propagator calls taking {:.3f}s".format(
+            self.propagator_calls, self.propagator_time))
+        print("  preprocessing removed {} values in {:.3f}s".format(
+            self.preprocess_pruned, self.preprocess_time))
+        print("  decisions by depth:", self.depth_histogram[1:])
+        print("  most revised constraints (revisions, prunings):")
+        for c, revisions, pruned in self.busiest_constraints(n):
+            print("    {} {} {}".format(c, revisions, pruned))
+        print("  {} of {} constraints revised without pruning anything".format(
+            len(self.idle_constraints()), len(self.constraints)))
+
+
+def luby(i):
+    '''i'th term (i >= 1) of the Luby sequence 1 1 2 1 1 2 4 1 1 2 ...
+       used to scale restart cutoffs'''
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i = i - (1 << (k - 1)) + 1
+
+
 class BT:
     '''use a class to encapsulate things like statistics
        and bookeeping for pruning/unpruning variabel domains
@@ -383,6 +1798,28 @@ class BT:
         unasgn_vars = list() #used to track unassigned variables
         self.TRACE = False
         self.runtime = 0
+        self.trail = None #undo stack for variable domains during search
+        self.var_ordering = 'mrv'
+        self.tie_break = 'position'
+        self.BACKJUMP = False #conflict directed backjumping
+        self.max_nogood_size = 20
+        self.nogoods = None
+        self.nBackjumps = 0
+        self.restarts = None  #restart policy, None, 'luby' or 'geometric'
+        self.restart_base = 100
+        self.restart_factor = 1.5
+        self.RANDOMIZE = False #random tie breaking and value ordering
+        self.seed = None
+        self.rng = None
+        self.ties = None      #variable --> tie breaking key
+        self.nFails = 0
+        self.nRestarts = 0
+        self.stats = SearchStats()
+        self.sampler = None   #profiling hook, see set_sampler
+        self.sample_every = 1000
+        self.preprocess = None #preprocessing pass, see set_preprocessing
+        self.SYMMETRY = False #break the symmetries declared on the CSP, see symmetry_on
+        self.symmetry = None  #symmetries in use, see lex_leader
 
     def trace_on(self):
         '''Turn search trace on'''
@@ -393,22 +1830,278 @@ class BT:
         self.TRACE = False
 
         
+    def backjump_on(self, max_nogood_size=20):
+        '''Use conflict directed backjumping and learn nogoods of at most
+           max_nogood_size assignments (0 learns none).
+
+           The reasons for prunings are not reported by propagators, so
+           they are derived from the constraint graph: a value pruned
+           after assigning the variable at level L is blamed on L and on
+           the reasons for the current domains of every other variable
+           sharing a constraint with the pruned variable (an assigned
+           variable's reason is its own level). A deadend is blamed on
+           the same reasons for the constraints of the new variable and
+           of every pruned variable. This is sound for propagators that
+           only work on the constraints of the new variable and of the
+           variables they pruned, which is the case for prop_BT, prop_FC
+           and prop_GAC.
+
+           Only bt_search backjumps: bt_resume and the enumeration of
+           solutions (bt_solutions) backtrack chronologically.'''
+        self.BACKJUMP = True
+        self.max_nogood_size = max_nogood_size
+
+    def backjump_off(self):
+        '''Use chronological backtracking'''
+        self.BACKJUMP = False
+
+    def symmetry_on(self):
+        '''Break the symmetries declared on the CSP (CSP.add_symmetry).
+           Off by default, as bt_search and enumerate_solutions then only
+           return lex leaders. An assignment is rejected as soon as a
+           symmetry maps the assigned variables to a lexicographically
+           smaller assignment (lex leader constraints checked on partial
+           assignments), so search finds one solution of each symmetry
+           class. count_solutions still counts all solutions, by adding
+           the number of distinct symmetric images of each one found.
+           Not done together with backjump_on, whose conflict reasons
+           only come from the constraints.'''
+        self.SYMMETRY = True
+
+    def symmetry_off(self):
+        '''Ignore the symmetries declared on the CSP (the default)'''
+        self.SYMMETRY = False
+
+    def randomize_on(self, seed=None):
+        '''Break ties between equally good variables at random and try
+           the values of each variable in random order. Every bt_search
+           starts a new random.Random(seed), so a given seed makes runs
+           reproducible.'''
+        self.RANDOMIZE = True
+        self.seed = seed
+
+    def randomize_off(self):
+        '''Deterministic tie breaking and value ordering'''
+        self.RANDOMIZE = False
+
+    def set_restarts(self, policy, base=100, factor=1.5):
+        '''Restart search from the root after a number of failures
+           (assignments rejected by the propagator) that grows with
+           every restart, so search is still complete.
+           policy == None        no restarts
+                     'luby'      the i'th run is cut off after
+                                 base * luby(i) failures
+                     'geometric' the i'th run is cut off after
+                                 base * factor**(i-1) failures
+           Restarts are only useful together with randomize_on or the
+           'domwdeg' ordering (whose constraint weights are kept across
+           the restarts of a bt_search). With backjump_on the learned
+           nogoods are kept as well. base must be positive, and factor
+           greater than 1 for 'geometric' (otherwise the cutoffs would
+           not grow and search would not be complete).'''
+        if not policy in [None, 'luby', 'geometric']:
+            print("Unknown restart policy", policy)
+            print("Must be one of [None, 'luby', 'geometric']")
+        elif policy is not None and base <= 0:
+            print("Restart base must be positive, not", base)
+        elif policy == 'geometric' and factor <= 1:
+            print("Geometric restart factor must be greater than 1, not", factor)
+        else:
+            self.restarts = policy
+            self.restart_base = base
+            self.restart_factor = factor
+
+    def restart_cutoff(self, run):
+        '''Number of failures allowed in the run'th run (from 1)'''
+        if self.restarts == 'luby':
+            return self.restart_base * luby(run)
+        if self.restarts == 'geometric':
+            return int(self.restart_base * self.restart_factor ** (run - 1))
+        return float('inf')
+
+    def break_ties(self):
+        '''Internal routine. Set the tie breaking keys of the variables:
+           (-degree, position in the CSP), or (0, position) if ties are
+           broken by position, with the position replaced by a random
+           number when randomizing.'''
+        for i, v in enumerate(self.csp.vars):
+            if self.RANDOMIZE:
+                i = self.rng.random()
+            if self.tie_break == 'degree':
+                self.ties[v] = (-len(self.csp.vars_to_cons[v]), i)
+            else:
+                self.ties[v] = (0, i)
+
+    def set_tie_break(self, rule):
+        '''Choose how ties of the variable ordering are broken
+           'degree'   == the variable in the most constraints first,
+                         then the first in the CSP
+           'position' == the first variable in the CSP (the default)
+           Neither wins everywhere. On the boards of tenner_sample_run
+           position is far better with prop_FC (model 1 on b1 and b2
+           makes 3502 and 3808 decisions against 27649 and 4725 by
+           degree), while degree halves the decisions of prop_GAC on b1
+           (122 against 268 with model 1, 98 against 193 with model 2).'''
+        if not rule in ['degree', 'position']:
+            print("Unknown tie break", rule)
+            print("Must be one of ['degree', 'position']")
+        else:
+            self.tie_break = rule
+
+    def set_var_ordering(self, ordering):
+        '''Choose how the next variable to assign is selected
+           'mrv'     == minimum remaining values, ties broken by
+                        position (see set_tie_break)
+           'domwdeg' == minimum of current domain size divided by the
+                        summed weight of the variable's constraints
+                        (weights are increased by the propagators on
+                        every domain wipeout a constraint causes)'''
+        if not ordering in ['mrv', 'domwdeg']:
+            print("Unknown variable ordering", ordering)
+            print("Must be one of ['mrv', 'domwdeg']")
+        else:
+            self.var_ordering = ordering
+
+    def set_preprocessing(self, prep):
+        '''Run the preprocessing pass prep(csp, propagator) after the
+           propagation at the root of every search, e.g., prep_SAC or
+           prep_RPC of propagators.py, so search starts from smaller
+           domains. The time it takes and the values it removes are
+           reported in the SearchStats. prep == None turns it off.'''
+        self.preprocess = prep
+
     def clear_stats(self):
         '''Initialize counters'''
         self.nDecisions = 0
         self.nPrunings = 0
+        self.nBackjumps = 0
+        self.nFails = 0
+        self.nRestarts = 0
         self.runtime = 0
+        self.stats = SearchStats()
+
+    def set_sampler(self, hook, every=1000):
+        '''Call hook(bt) after every 'every' variable assignments, with
+           bt this BT object, e.g., to sample where search spends its time
+           (bt.stack, bt.trail.depth(), bt.stats...). hook == None turns
+           sampling off.'''
+        self.sampler = hook
+        self.sample_every = every
+
+    def count_decision(self, level):
+        '''Internal routine. Count a variable assignment made at level'''
+        self.nDecisions = self.nDecisions+1
+        self.stats.decision(level)
+        if self.sampler is not None and self.nDecisions % self.sample_every == 0:
+            self.sampler(self)
+
+    def timed(self, propagator):
+        '''Internal routine. propagator, adding the time spent in it to
+           the statistics'''
+        stats = self.stats
+        clock = time.perf_counter
+        def call(csp, newVar=None):
+            t = clock()
+            result = propagator(csp, newVar)
+            stats.propagator_time += clock() - t
+            stats.propagator_calls += 1
+            return result
+        return call
+
+    def compile_symmetries(self):
+        '''Internal routine. The CSP's symmetries as tables: table[i][x]
+           is the (variable position, value index) of the image of the
+           i'th variable's x'th value'''
+        position = dict()
+        for i, var in enumerate(self.csp.vars):
+            position[var] = i
+        tables = []
+        for symmetry in self.csp.symmetries:
+            table = []
+            for var in self.csp.vars:
+                images = []
+                for val in var.domain():
+                    image, image_val = symmetry(var, val)
+                    images.append((position[image], image.value_index(image_val)))
+                table.append(images)
+            tables.append(table)
+        return tables
+
+    def current_indices(self):
+        '''Internal routine. Value index of each variable, -1 if unassigned'''
+        return [var.val_index[var.assignedValue] if var.assignedValue is not None
+                else -1 for var in self.csp.vars]
+
+    def lex_leader(self, propagator):
+        '''Internal routine. propagator, rejecting the new assignment
+           when a symmetry maps the assigned variables to an assignment
+           that is lexicographically smaller whatever values the other
+           variables get'''
+        tables = self.symmetry
+        current = self.current_indices
+        def call(csp, newVar=None):
+            if newVar is not None:
+                values = current()
+                for table in tables:
+                    image = [-1] * len(values)
+                    for i, x in enumerate(values):
+                        if x >= 0:
+                            j, y = table[i][x]
+                            image[j] = y
+                    for x, y in zip(values, image):
+                        if x < 0 or y < 0 or x < y:
+                            break
+                        if y < x:
+                            return False, []
+            return propagator(csp, newVar)
+        return call
+
+    def orbit_size(self):
+        '''Internal routine. Number of distinct symmetric images of the
+           solution the variables are assigned to (1 without symmetries)'''
+        if not self.symmetry:
+            return 1
+        values = self.current_indices()
+        images = set([tuple(values)])
+        for table in self.symmetry:
+            image = [0] * len(values)
+            for i, x in enumerate(values):
+                j, y = table[i][x]
+                image[j] = y
+            images.add(tuple(image))
+        return len(images)
 
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
             self.nDecisions, self.nPrunings))
+        if self.BACKJUMP:
+            print("Search jumped back over {} levels and learned {} nogoods".format(
+                self.nBackjumps, self.nogoods.n_nogoods))
+        if self.restarts:
+            print("Search restarted {} times".format(self.nRestarts))
+        if self.preprocess is not None:
+            print("Preprocessing removed {} values in {:.3f} seconds".format(
+                self.stats.preprocess_pruned, self.stats.preprocess_time))
 
     def restoreValues(self,prunings):
         '''Restore list of values to variable domains
-           each item in prunings is a pair (var, val)'''
+           each item in prunings is a pair (var, val). Search itself
+           undoes prunings through self.trail'''
         for var, val in prunings:
             var.unprune_value(val)
 
+    def attach_trail(self):
+        '''Make the CSP variables save their domains on self.trail'''
+        self.trail = Trail()
+        for var in self.csp.vars:
+            var.trail = self.trail
+            var.trail_stamp = -1
+
+    def detach_trail(self):
+        '''Stop recording domain changes once search is over'''
+        for var in self.csp.vars:
+            var.trail = None
+
     def restore_all_variable_domains(self):
         '''Reinitialize all variable domains'''
         for var in self.csp.vars:
@@ -417,26 +2110,52 @@ class BT:
             var.restore_curdom()
 
     def extractMRVvar(self):
-        '''Remove variable with minimum sized cur domain from list of
-           unassigned vars. Would be faster to use heap...but this is
-           not production code.
+        '''Remove variable chosen by the variable ordering from the
+           unassigned vars, held in an MRVBuckets object. For 'domwdeg'
+           the buckets are scanned by increasing domain size, and the
+           scan stops once the domain size divided by the largest
+           weighted degree any variable can have exceeds the best
+           ratio found.
         '''
+        if self.var_ordering == 'mrv':
+            return self.unasgn_vars.extract()
+
+        if self.wdeg_fails is None or self.nFails - self.wdeg_fails >= len(self.csp.vars):
+            self.wdeg_bound = 0
+            for v in self.csp.vars:
+                wdeg = sum(c.weight for c in self.csp.vars_to_cons[v])
+                self.wdeg_bound = max(self.wdeg_bound, wdeg)
+            self.wdeg_fails = self.nFails
+        #a failure adds 1 to the weight of one constraint, so at most 1
+        #to any weighted degree
+        bound = self.wdeg_bound + self.nFails - self.wdeg_fails
 
         md = -1
         mv = None
-        for v in self.unasgn_vars:
-            if md < 0:
-                md = v.cur_domain_size()
-                mv = v
-            elif v.cur_domain_size() < md:
-                md = v.cur_domain_size()
-                mv = v
+        for size in range(len(self.unasgn_vars.buckets)):
+            bucket = self.unasgn_vars.members(size)
+            if not bucket:
+                continue
+            if mv is not None and bound and size / bound > md:
+                break
+            for v in bucket:
+                wdeg = 0
+                for c in self.csp.vars_to_cons[v]:
+                    if c.get_n_unasgn() > 1:
+                        wdeg = wdeg + c.weight
+                if wdeg:
+                    d = size / wdeg
+                else:
+                    d = float('inf')
+                if md < 0 or d < md or (d == md and self.ties[v] < self.ties[mv]):
+                    md = d
+                    mv = v
         self.unasgn_vars.remove(mv)
         return mv
 
     def restoreUnasgnVar(self, var):
         '''Add variable back to list of unassigned vars'''
-        self.unasgn_vars.append(var)
+        self.unasgn_vars.add(var)
         
     def bt_search(self,propagator):
         '''Try to solve the CSP using specified propagator routine
@@ -464,37 +2183,32 @@ class BT:
 
            The list of variable values pairs are all of the values
            the propagator pruned (using the variable's prune_value method). 
-           bt_search NEEDS to know this in order to correctly restore these 
-           values when it undoes a variable assignment.
+           bt_search uses it for its statistics. The pruned values
+           themselves are restored from the trail (see class Trail)
+           when bt_search undoes a variable assignment.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
-           pruned! Nor should it prune a value twice'''
+           pruned! Nor should it prune a value twice
 
-        self.clear_stats()
-        stime = time.process_time()
+           Variables given a value by CSP.add_assignment have their
+           domains restricted to it before the root propagation.
 
-        self.restore_all_variable_domains()
-        
-        self.unasgn_vars = []
-        for v in self.csp.vars:
-            if not v.is_assigned():
-                self.unasgn_vars.append(v)
+           Returns the SearchStats of the search.'''
 
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
+        self.clear_stats()
+        stime = time.process_time()
 
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
+        status = self.bt_start(propagator)
 
         if status == False:
             print("CSP{} detected contradiction at root".format(
                 self.csp.name))
+        elif self.BACKJUMP:
+            status = self.cbj_search()
         else:
-            status = self.bt_recurse(propagator, 1)   #now do recursive search
+            status = self.bt_resume()   #now do the search
 
-
-        self.restoreValues(prunings)
+        self.bt_stop()
         if status == False:
             print("CSP{} unsolved. Has no solutions".format(self.csp.name))
         if status == True:
@@ -504,46 +2218,616 @@ class BT:
 
         print("bt_search finished")
         self.print_stats()
+        self.stats.finish(self, status)
+        return self.stats
+
+    def bt_start(self, propagator, all_solutions=False):
+        '''Set up a search with the propagator (see bt_search) and
+           propagate at the root. Returns False if the root propagation
+           found a deadend. The search itself is run by bt_resume and
+           must be ended by bt_stop. Restarts (see set_restarts) are not
+           made when all_solutions is True, as they would find the same
+           solutions again.'''
 
-    def bt_recurse(self, propagator, level):
-        '''Return true if found solution. False if still need to search.
-           If top level returns false--> no solution'''
+        self.restore_all_variable_domains()
+        self.attach_trail()
+
+        self.rng = random.Random(self.seed)
+        self.ties = dict()
+        self.break_ties()
+        self.unasgn_vars = MRVBuckets(self.ties)
+        if self.var_ordering == 'domwdeg':
+            for c in self.csp.cons:
+                c.weight = 1
+        self.wdeg_fails = None  #nFails when wdeg_bound was computed
+        self.wdeg_bound = 0     #largest summed weight of any variable
+        for v in self.csp.vars:
+            if not v.is_assigned():
+                self.restoreUnasgnVar(v)
+
+        if self.BACKJUMP:
+            self.nogoods = NogoodStore(self.max_nogood_size)
+
+        self.stats.start = time.process_time()
+        for c in self.csp.cons:
+            c.n_revisions = 0
+            c.n_pruned = 0
+        self.symmetry = None
+        if self.SYMMETRY and self.csp.symmetries:
+            if self.BACKJUMP:
+                print("ERROR: symmetries are not broken when backjumping")
+            else:
+                self.symmetry = self.compile_symmetries()
+                propagator = self.lex_leader(propagator)
+        propagator = self.timed(propagator)
+        self.propagator = propagator
+        self.all_solutions = all_solutions
+        self.run = 1
+        self.fail_limit = self.nFails + self.restart_cutoff(self.run)
+        if all_solutions:
+            self.fail_limit = float('inf')
+            if self.BACKJUMP:
+                print("ERROR: backjumping is not done when enumerating solutions")
+        self.stack = []       #[var, values, index of next value, prunings]
+        self.descend = True   #the next step picks a new variable
+        self.solved = False   #the variables hold a solution
+
+        self.trail.push_level()
+        status = self.restrict_root()
+        prunings = []
+        if status:
+            status, prunings = propagator(self.csp) #initial propagate no assigned variables.
+            self.nPrunings = self.nPrunings + len(prunings)
+        if status and self.preprocess is not None:
+            stime = time.process_time()
+            status, removed = self.preprocess(self.csp, propagator)
+            self.nPrunings = self.nPrunings + len(removed)
+            self.stats.preprocess_time = time.process_time() - stime
+            self.stats.preprocess_pruned = len(removed)
+            prunings = prunings + removed
 
         if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
-        if not self.unasgn_vars:
-            #all variables assigned
-            return True
-        else:
-            var = self.extractMRVvar()
-            if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
+            print(len(self.unasgn_vars), " unassigned variables at start of search")
+            print("Root Prunings: ", prunings)
 
+        if status == False:
+            self.stack = None
+        else:
+            self.csp.set_root_state(dict((v, v.curdom) for v in self.csp.vars))
+        return status
+
+    def restrict_root(self):
+        '''Internal routine. Start from the domains left by an earlier
+           root propagation (see CSP.push) and restrict the variables
+           given values by CSP.add_assignment. Returns False if some
+           domain is left empty.'''
+        domains = self.csp.get_root_state()
+        if domains is not None:
+            for var in self.csp.vars:
+                mask = domains[var]
+                for val in var.cur_domain():
+                    if not (mask >> var.value_index(val)) & 1:
+                        var.prune_value(val)
+        for var, value in self.csp.get_assignments():
+            if not var.in_cur_domain(value):
+                return False
             for val in var.cur_domain():
+                if val != value:
+                    var.prune_value(val)
+        for var in self.csp.vars:
+            if not var.cur_domain_size():
+                return False
+        return True
 
+    def bt_stop(self):
+        '''End a search started by bt_start. The variables keep their
+           assignments (if the search stopped on a solution) but all
+           prunings are undone.'''
+        while self.trail.depth() > 0:
+            self.trail.pop_level()
+        self.detach_trail()
+        self.unasgn_vars.clear()
+        self.stack = None
+
+    def restart(self):
+        '''Internal routine. Begin the next run once a run is cut off'''
+        if self.TRACE:
+            print("Restarting after {} failures".format(self.nFails))
+        self.nRestarts = self.nRestarts + 1
+        self.run = self.run + 1
+        self.fail_limit = self.nFails + self.restart_cutoff(self.run)
+        if self.RANDOMIZE:
+            self.break_ties()
+            self.unasgn_vars.rebuild()
+
+    def bt_resume(self, max_decisions=None):
+        '''Run the search started by bt_start, without recursion. The
+           search state is kept on an explicit stack in self, so it can
+           be paused and resumed. The search backtracks chronologically,
+           backjumping (see backjump_on) is only done by bt_search.
+           Returns True when a solution is found (the variables are
+           assigned to it; calling bt_resume again looks for the next
+           solution), False when there are no more solutions, and None
+           if it was paused after making max_decisions more variable
+           assignments.'''
+
+        stack = self.stack
+        if stack is None:
+            return False
+        if max_decisions is None:
+            limit = float('inf')
+        else:
+            limit = self.nDecisions + max_decisions
+        propagator = self.propagator
+        trail = self.trail
+
+        if self.solved:
+            #move on from the last solution
+            self.solved = False
+            if not stack:
+                self.stack = None
+                return False
+            frame = stack[-1]
+            if self.TRACE:
+                print('  ' * len(stack), "bt_resume restoring ", frame[3])
+            trail.pop_level()
+            frame[0].unassign()
+            self.descend = False
+
+        descend = self.descend
+        while True:
+            if descend:
+                level = len(stack) + 1
+                if self.TRACE:
+                    print('  ' * level, "bt_resume level ", level)
+                if not self.unasgn_vars:
+                    #all variables assigned
+                    self.stats.solution()
+                    self.solved = True
+                    self.descend = True
+                    return True
+                var = self.extractMRVvar()
+                if self.TRACE:
+                    print('  ' * level, "bt_resume var = ", var)
+                values = var.cur_domain()
+                if self.RANDOMIZE:
+                    self.rng.shuffle(values)
+                stack.append([var, values, 0, None])
+                descend = False
+
+            frame = stack[-1]
+            var, values, i, _ = frame
+            level = len(stack)
+
+            if i == len(values):
+                #all values failed, undo the assignment one level up
+                stack.pop()
+                self.restoreUnasgnVar(var)
+                self.stats.backtracks = self.stats.backtracks + 1
+                if not stack:
+                    self.stack = None
+                    return False
+                frame = stack[-1]
                 if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
+                    print('  ' * (level - 1), "bt_resume restoring ", frame[3])
+                trail.pop_level()
+                frame[0].unassign()
+                continue
 
-                var.assign(val)
-                self.nDecisions = self.nDecisions+1
+            if self.nDecisions >= limit:
+                self.descend = False
+                return None
 
-                status, prunings = propagator(self.csp, var)
-                self.nPrunings = self.nPrunings + len(prunings)
+            val = values[i]
+            frame[2] = i + 1
+            if self.TRACE:
+                print('  ' * level, "bt_resume trying", var, "=", val)
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
+            trail.push_level()
+            var.assign(val)
+            self.count_decision(level)
 
-                if status:
-                    if self.bt_recurse(propagator, level+1):
-                        return True
+            status, prunings = propagator(self.csp, var)
+            self.nPrunings = self.nPrunings + len(prunings)
+            frame[3] = prunings
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
-                self.restoreValues(prunings)
+            if self.TRACE:
+                print('  ' * level, "bt_resume prop status = ", status)
+                print('  ' * level, "bt_resume prop pruned = ", prunings)
+
+            if status:
+                descend = True
+                continue
+
+            self.nFails = self.nFails + 1
+            if self.TRACE:
+                print('  ' * level, "bt_resume restoring ", prunings)
+            trail.pop_level()
+            var.unassign()
+
+            if self.nFails >= self.fail_limit:
+                #cut off, undo every assignment and start from the root
+                while stack:
+                    self.restoreUnasgnVar(stack.pop()[0])
+                    if stack:
+                        trail.pop_level()
+                        stack[-1][0].unassign()
+                self.restart()
+                descend = True
+
+    def bt_solutions(self, propagator):
+        '''Generator over all solutions of the CSP found with the
+           propagator (see bt_search). Each solution is a list of
+           (Variable, value) pairs, in the order of the CSP's variables;
+           the variables stay assigned to it until the next one is
+           asked for. Statistics accumulate over the whole enumeration.'''
+        self.clear_stats()
+        try:
+            if self.bt_start(propagator, all_solutions=True) != False:
+                while self.bt_resume():
+                    yield [(v, v.get_assigned_value()) for v in self.csp.vars]
+        finally:
+            self.bt_stop()
+            self.stats.finish(self, self.stats.first_solution_time is not None)
+
+    def enumerate_solutions(self, propagator, limit=None):
+        '''Generator of the solutions of the CSP (at most limit of them)
+           found with the propagator, each as a dictionary mapping every
+           Variable to its value. See bt_solutions.'''
+        if limit is not None and limit <= 0:
+            return
+        solutions = self.bt_solutions(propagator)
+        try:
+            n = 0
+            for solution in solutions:
+                yield dict(solution)
+                n = n + 1
+                if limit is not None and n >= limit:
+                    break
+        finally:
+            solutions.close()
+
+    def count_solutions(self, propagator, limit=None, decompose=True):
+        '''Return the number of solutions of the CSP, counting at most
+           limit (e.g., limit=2 tells if a puzzle has a unique solution).
+           No solution is built or printed.
+
+           With decompose the constraint graph is split into connected
+           components, leaving out the variables that have a single value
+           (in their domain or by CSP.add_assignment), as they are the
+           same in every solution. Each component is counted by its own
+           search and the counts are multiplied, instead of enumerating
+           their combinations. The counters of this BT object add up the
+           work of all the searches. Not done when the CSP's symmetries
+           are broken (see symmetry_on), each solution found then
+           counts for all its symmetric images.'''
+        if limit is not None and limit <= 0:
+            return 0
+        if self.SYMMETRY and self.csp.symmetries:
+            #the symmetries are of the whole CSP, not of its parts
+            decompose = False
+        parts = self.components() if decompose else None
+        if not parts or len(parts) == 1:
+            self.clear_stats()
+            n = self.count_csp(self, propagator, limit)
+            self.stats.finish(self, n > 0)
+            return n
+
+        nDecisions = nPrunings = nFails = 0
+        total = 1
+        counts = []
+        for k, (vars, cons) in enumerate(parts):
+            csp = CSP("{}/{}".format(self.csp.name, k), vars)
+            csp.push()      #popped to release the constraints
+            for c in cons:
+                csp.add_constraint(c)
+            for var, value in self.csp.get_assignments():
+                if var in csp.vars_to_cons:
+                    csp.add_assignment(var, value)
+            solver = BT(csp)
+            solver.var_ordering = self.var_ordering
+            solver.tie_break = self.tie_break
+            solver.preprocess = self.preprocess
+            n = self.count_csp(solver, propagator, limit)
+            csp.pop()
+            nDecisions = nDecisions + solver.nDecisions
+            nPrunings = nPrunings + solver.nPrunings
+            nFails = nFails + solver.nFails
+            counts.append(n)
+            if n == 0:
+                total = 0
+                break
+        if total:
+            for n in counts:
+                total = total * n
+            if limit is not None:
+                total = min(total, limit)
+        self.clear_stats()
+        self.nDecisions = nDecisions
+        self.nPrunings = nPrunings
+        self.nFails = nFails
+        self.stats.finish(self, total > 0)
+        for var in self.csp.vars:
+            if var.is_assigned():
                 var.unassign()
+        return total
 
-            self.restoreUnasgnVar(var)
-            return False
+    def count_csp(self, solver, propagator, limit):
+        '''Internal routine. Count the solutions of solver's CSP, at
+           most limit, leaving its variables unassigned'''
+        n = 0
+        solver.clear_stats()
+        if solver.bt_start(propagator, all_solutions=True) != False:
+            while (limit is None or n < limit) and solver.bt_resume():
+                n = n + solver.orbit_size()
+        solver.bt_stop()
+        for var in solver.csp.vars:
+            if var.is_assigned():
+                var.unassign()
+        if limit is not None:
+            n = min(n, limit)
+        return n
+
+    def components(self):
+        '''Internal routine. Split the CSP into independent parts, a
+           list of (variables, constraints) (see count_solutions).'''
+        fixed = set(var for var, _ in self.csp.get_assignments())
+        for var in self.csp.vars:
+            if var.domain_size() == 1:
+                fixed.add(var)
+
+        parent = dict()
+        def find(v):
+            while parent[v] is not v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
+        for var in self.csp.vars:
+            parent[var] = var
+
+        own = []    #constraints over fixed variables only
+        for c in self.csp.cons:
+            free = [v for v in c.scope if not v in fixed]
+            if not free:
+                own.append(c)
+            for v in free[1:]:
+                a, b = find(free[0]), find(v)
+                if a is not b:
+                    parent[b] = a
+
+        parts = dict()  #root variable --> (variables, constraints)
+        for var in self.csp.vars:
+            if not var in fixed:
+                parts.setdefault(find(var), ([], []))[0].append(var)
+        for c in self.csp.cons:
+            free = [v for v in c.scope if not v in fixed]
+            if free:
+                vars, cons = parts[find(free[0])]
+                cons.append(c)
+                for v in c.scope:
+                    if v in fixed and not v in vars:
+                        vars.append(v)
+        result = list(parts.values())
+        for c in own:
+            result.append((list(c.scope), [c]))
+        return result
+
+    #
+    #conflict directed backjumping
+    #
+
+    def why(self, var, step=None):
+        '''Internal routine. Levels responsible for var's current domain:
+           its own level if assigned, otherwise the reasons recorded for
+           its pruned values (plus those in step, the reasons being
+           worked out for the current level).'''
+        level = self.asgn_level.get(var)
+        if level is not None:
+            return set([level])
+        reasons = set()
+        for _, r in self.expl.get(var, ()):
+            reasons |= r
+        if step and var in step:
+            reasons |= step[var]
+        return reasons
+
+    def record(self, level, var, reasons):
+        '''Internal routine. Remember why values of var were pruned at level'''
+        if level == 0:
+            return
+        self.expl.setdefault(var, []).append((level, reasons))
+        self.expl_vars[level].append(var)
+
+    def explain(self, level, var, prunings, status):
+        '''Internal routine. Record reasons for the prunings made by the
+           propagator after var was assigned at level (see backjump_on).
+           If status is False return the levels blamed for the deadend.'''
+        pruned = []
+        for v, _ in prunings:
+            if not v in pruned:
+                pruned.append(v)
+
+        #reasons from earlier levels, then those of this level, until
+        #they stop growing (a pruning can be blamed on another one)
+        before = dict()
+        neighbours = dict()
+        for v in [var] + pruned:
+            around = set()
+            for c in self.csp.vars_to_cons[v]:
+                around.update(c.scope)
+            around.discard(v)
+            neighbours[v] = around
+            for z in around:
+                if not z in before:
+                    before[z] = self.why(z)
+        step = dict()
+        for v in pruned:
+            reasons = set([level])
+            for z in neighbours[v]:
+                reasons |= before[z]
+            step[v] = reasons
+        changed = True
+        while changed:
+            changed = False
+            for v in pruned:
+                reasons = step[v]
+                n = len(reasons)
+                for z in neighbours[v]:
+                    if z in step:
+                        reasons |= step[z]
+                if len(reasons) != n:
+                    changed = True
+        for v in pruned:
+            self.record(level, v, step[v])
+
+        if status:
+            return None
+        conflict = set([level])
+        for v in [var] + pruned:
+            conflict |= step.get(v, before.get(v, set()))
+            for z in neighbours[v]:
+                conflict |= before[z]
+                if z in step:
+                    conflict |= step[z]
+        return conflict
+
+    def nogood_propagate(self, level, var, val):
+        '''Internal routine. Prune values ruled out by learned nogoods
+           now that var = val. Returns the levels blamed for a deadend,
+           or None.'''
+        conflict, units = self.nogoods.propagate(var, val)
+        if conflict is not None:
+            return set(self.asgn_level[v] for v, _ in conflict)
+        for (v, x), ng in units:
+            if not v.in_cur_domain(x):
+                continue
+            reasons = set(self.asgn_level[u] for u, _ in ng if u is not v)
+            v.prune_value(x)
+            self.nPrunings = self.nPrunings + 1
+            self.record(level, v, reasons)
+            if not v.cur_domain_size():
+                return self.why(v) | set([level])
+        return None
+
+    def undo_level(self, level, var):
+        '''Internal routine. Undo the assignment of var at level'''
+        self.trail.pop_level()
+        var.unassign()
+        del self.asgn_level[var]
+        self.decisions.pop()
+        for v in self.expl_vars.pop():
+            self.expl[v].pop()
+
+    def cbj_search(self):
+        '''Conflict directed backjumping form of bt_resume, run by
+           bt_search after bt_start when backjumping (see backjump_on).
+           Each level keeps its conflict set: the levels whose
+           assignments explain why the subtrees tried so far have no
+           solution. When a level runs out of values the levels not in
+           its conflict set are jumped over without trying their other
+           values. Restarts (see set_restarts) are made here. Returns
+           True if a solution was found, False if there is none.'''
+
+        propagator = self.propagator
+        trail = self.trail
+        stack = []    #[var, values, index of next value, conflict set]
+        self.asgn_level = dict()    #assigned variable --> its level
+        self.decisions = [None]     #decisions[level] = (var, val)
+        self.expl = dict()          #var --> [(level, reason levels)]
+        self.expl_vars = [[]]       #expl_vars[level] = vars explained
+        descend = True
+        while True:
+            if descend:
+                level = len(stack) + 1
+                if self.TRACE:
+                    print('  ' * level, "cbj_search level ", level)
+                if not self.unasgn_vars:
+                    #all variables assigned
+                    self.stats.solution()
+                    return True
+                var = self.extractMRVvar()
+                if self.TRACE:
+                    print('  ' * level, "cbj_search var = ", var)
+                values = var.cur_domain()
+                if self.RANDOMIZE:
+                    self.rng.shuffle(values)
+                stack.append([var, values, 0, set()])
+                descend = False
+
+            frame = stack[-1]
+            var, values, i, conflict = frame
+            level = len(stack)
+
+            if i == len(values):
+                #the values of var pruned before this level count as well
+                conflict.discard(level)
+                conflict |= self.why(var)
+                conflict.discard(0)
+
+                #the assignments in the conflict set can't be extended, learn them
+                learned = sorted(conflict, reverse=True)
+                self.nogoods.add([self.decisions[l] for l in learned])
+
+                if self.TRACE:
+                    print('  ' * level, "cbj_search", var, "failed, conflict levels", learned)
+                self.stats.backtracks = self.stats.backtracks + 1
+                self.restoreUnasgnVar(var)
+                stack.pop()
+
+                #undo the levels above the deepest one in the conflict set
+                while stack and not len(stack) in conflict:
+                    frame = stack.pop()
+                    if self.TRACE:
+                        print('  ' * len(stack), "cbj_search jumping back over", frame[0])
+                    self.nBackjumps = self.nBackjumps + 1
+                    self.undo_level(len(stack) + 1, frame[0])
+                    self.restoreUnasgnVar(frame[0])
+                if not stack:
+                    return False
+                stack[-1][3] |= conflict
+                self.undo_level(len(stack), stack[-1][0])
+                continue
+
+            val = values[i]
+            frame[2] = i + 1
+            if self.TRACE:
+                print('  ' * level, "cbj_search trying", var, "=", val)
 
+            trail.push_level()
+            var.assign(val)
+            self.asgn_level[var] = level
+            self.decisions.append((var, val))
+            self.expl_vars.append([])
+            self.count_decision(level)
+
+            failure = self.nogood_propagate(level, var, val)
+            if failure is None:
+                status, prunings = propagator(self.csp, var)
+                self.nPrunings = self.nPrunings + len(prunings)
+                failure = self.explain(level, var, prunings, status)
+
+                if self.TRACE:
+                    print('  ' * level, "cbj_search prop status = ", status)
+                    print('  ' * level, "cbj_search prop pruned = ", prunings)
+
+            if failure is None:
+                descend = True
+                continue
+
+            self.nFails = self.nFails + 1
+            conflict |= failure
+            self.undo_level(level, var)
+
+            if self.nFails >= self.fail_limit:
+                #cut off, undo every assignment and start from the root
+                while stack:
+                    var = stack.pop()[0]
+                    self.restoreUnasgnVar(var)
+                    if stack:
+                        self.undo_level(len(stack), stack[-1][0])
+                self.restart()
+                self.asgn_level = dict()
+                self.decisions = [None]
+                self.expl = dict()
+                self.expl_vars = [[]]
+                descend = True
@@ -0,0 +1,79 @@
+'''Forward checking benchmark on the n-queens CSP of csp_sample_run.py.
+
+   Times bt_search with prop_FC, which lets each constraint prune the
+   unassigned variable itself (Constraint.forward_check: the support
+   index of a table, or one reused list of values for a predicate),
+   against prop_FC_check, forward checking done the way prop_FC first
+   did it: a list of values is built for every value of the unassigned
+   variable and passed to constraint.check. Each is run on the table
+   model of csp_sample_run.nQueens and on the same model written with
+   FunctionConstraints.
+
+   python fc_benchmark.py [n ...]
+'''
+
+import sys
+import time
+import io
+import contextlib
+
+from cspbase import *
+from propagators import *
+from csp_sample_run import nQueens, queensCheck
+
+def prop_FC_check(csp, newVar=None):
+    '''prop_FC checking every value with a new list of values'''
+    constraints = csp.get_all_cons()
+    if newVar:
+        constraints = csp.get_cons_with_var(newVar)
+
+    pruned_vals = []
+    for constraint in constraints:
+        if constraint.get_n_unasgn() != 1:
+            continue
+        variables = constraint.get_scope()
+        values = [variable.get_assigned_value() for variable in variables]
+        unassigned_variable = constraint.get_unasgn_vars()[0]
+        for domain_value in unassigned_variable.cur_domain():
+            copied_values = [value if value is not None else domain_value
+                             for value in values]
+            if not constraint.check(copied_values):
+                unassigned_variable.prune_value(domain_value)
+                pruned_vals.append((unassigned_variable, domain_value))
+        if not unassigned_variable.cur_domain_size():
+            return False, pruned_vals
+    return True, pruned_vals
+
+def nQueens_function(n):
+    '''n-queens CSP with the constraints of nQueens given by predicates'''
+    dom = list(range(1, n + 1))
+    vars = [Variable('Q{}'.format(i), dom) for i in dom]
+    csp = CSP("{}-Queens".format(n), vars)
+    for qi in range(n):
+        for qj in range(qi + 1, n):
+            csp.add_constraint(FunctionConstraint(
+                "C(Q{},Q{})".format(qi + 1, qj + 1), [vars[qi], vars[qj]],
+                lambda vals, qi=qi, qj=qj: queensCheck(qi, qj, vals[0], vals[1])))
+    return csp
+
+def run(model, propagator, n):
+    '''Return (CPU seconds, decisions, prunings) of bt_search'''
+    csp = model(n)
+    solver = BT(csp)
+    stime = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver.bt_search(propagator)
+    return time.process_time() - stime, solver.nDecisions, solver.nPrunings
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [20, 40, 60]
+    print("{:>4} {:>9} {:>14} {:>9} {:>10} {:>9}".format(
+        "n", "model", "propagator", "seconds", "decisions", "speedup"))
+    for n in sizes:
+        for name, model in (("table", nQueens), ("function", nQueens_function)):
+            base, d, p = run(model, prop_FC_check, n)
+            print("{:>4} {:>9} {:>14} {:>9.3f} {:>10}".format(
+                n, name, "prop_FC_check", base, d))
+            t, d, p = run(model, prop_FC, n)
+            print("{:>4} {:>9} {:>14} {:>9.3f} {:>10} {:>8.1f}x".format(
+                n, name, "prop_FC", t, d, base / max(t, 1e-9)))
@@ -34,6 +34,12 @@
       NOTE propagator SHOULD NOT prune a value that has already been
       pruned! Nor should it prune a value twice
 
+      When a constraint causes a deadend the propagator increases that
+      constraint's weight by one (used by the dom/wdeg variable ordering
+      of bt_search). Every time a constraint is checked or used to prune
+      it also counts that in n_revisions, and the values it pruned in
+      n_pruned (reported by the SearchStats of bt_search).
+
       PROPAGATOR called with newVar = None
       PROCESSING REQUIRED:
         for plain backtracking (where we only check fully instantiated
@@ -58,8 +64,20 @@
          that have one unassigned variable left
 
          for gac we initialize the GAC queue with all constraints containing V.
+
+   preprocessing pass == a function with the template
+      prep(csp, propagator)
+           ==> returns (True/False, [(Variable, Value), (Variable, Value) ...]
+
+      called by bt_search (see BT.set_preprocessing) after the root
+      propagation, to remove values that the propagator alone keeps.
+      It returns like a propagator, with all the values it pruned
+      (including those pruned by the calls it made to the propagator).
+      prep_SAC and prep_RPC below are such passes.
    '''
 
+from collections import deque
+
 
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no
@@ -73,7 +91,9 @@ def prop_BT(csp, newVar=None):
             vars = c.get_scope()
             for var in vars:
                 vals.append(var.get_assigned_value())
+            c.n_revisions = c.n_revisions + 1
             if not c.check(vals):
+                c.weight = c.weight + 1
                 return False, []
     return True, []
 
@@ -86,33 +106,25 @@ def prop_FC(csp, newVar=None):
     if newVar:
         constraints = csp.get_cons_with_var(newVar)
 
-    # filter out all with > 1 unassigned variables
-    constraints = [constraint for constraint in constraints if constraint.get_n_unasgn() == 1]
-
     pruned_vals = []
-    found_deadend = True
 
     for constraint in constraints:
-        variables = constraint.get_scope()
-        values = [variable.get_assigned_value() for variable in variables]
-
+        # skip all with > 1 unassigned variables
+        if constraint.get_n_unasgn() != 1:
+            continue
         unassigned_variable = constraint.get_unasgn_vars()[0]
-        found_deadend = False
-
-        for domain_value in unassigned_variable.cur_domain():
-            copied_values = [
-                value
-                if value is not None else domain_value
-                for value in values
-            ]
 
-            if not constraint.check(copied_values):
-                unassigned_variable.prune_value(domain_value)
-                pruned_vals.append((unassigned_variable, domain_value))
-            else:
-                found_deadend = True
+        # the constraint prunes the values that fail with the assigned ones
+        n_pruned = len(pruned_vals)
+        status = constraint.forward_check(unassigned_variable, pruned_vals)
+        constraint.n_revisions = constraint.n_revisions + 1
+        constraint.n_pruned = constraint.n_pruned + len(pruned_vals) - n_pruned
+        if not status:
+            # Domain wipeout
+            constraint.weight = constraint.weight + 1
+            return False, pruned_vals
 
-    return found_deadend, pruned_vals
+    return True, pruned_vals
 
 
 def prop_GAC(csp, newVar=None):
@@ -123,26 +135,168 @@ def prop_GAC(csp, newVar=None):
     if newVar:
         constraints = csp.get_cons_with_var(newVar)
 
+    return GAC_enforce(csp, constraints)
+
+
+def prop_GAC_value(csp, newVar=None):
+    '''prop_GAC with the 'value' schedule of GAC_enforce, the way
+       prop_GAC first queued constraints: the constraints of a variable
+       are offered to the queue after every value pruned from it. As
+       the queue skips constraints already on it, this revises the same
+       constraints as prop_GAC and only makes more membership checks
+       (on the Tenner boards b1 and b2 of model 1 it is about 5% slower
+       for the same decisions and revisions).'''
+    constraints = csp.get_all_cons()
+    if newVar:
+        constraints = csp.get_cons_with_var(newVar)
+
+    return GAC_enforce(csp, constraints, schedule='value')
+
+
+def GAC_enforce(csp, constraints, schedule='variable'):
+    '''Enforce GAC starting with constraints on the GAC queue. The queue
+       is a deque and a set records which constraints are on it, so both
+       taking the next constraint and the membership test are O(1).
+
+       schedule == 'variable': after a constraint is revised for one of
+                   its variables, the constraints of that variable are
+                   queued once if its domain changed (AC-3 revise).
+       schedule == 'value':    the constraints of a variable are queued
+                   after every single value pruned from it.
+
+       Each constraint does its own filtering through its revise method
+       (support checks for table constraints, dedicated filtering for
+       intensional ones).
+
+       Returns (True/False, pruned values) like a propagator.'''
+    per_value = schedule == 'value'
+    queue = deque(constraints)
+    in_queue = set(queue)
+
     pruned_vals = []
-    while constraints:
-        constraint = constraints.pop(0)
-
-        for variable in constraint.get_scope():
-            for domain_value in variable.cur_domain():
-                if not constraint.has_support(variable, domain_value):
-                    variable.prune_value(domain_value)
-                    pruned_vals.append((variable, domain_value))
-
-                    if not variable.cur_domain_size():
-                        # Domain wipeout
-                        return False, pruned_vals
-
-                    new_constraints = [
-                        constr
-                        for constr in csp.get_cons_with_var(variable)
-                        if constr not in constraints
-                    ]
-                    constraints.extend(new_constraints)
+    while queue:
+        constraint = queue.popleft()
+        in_queue.discard(constraint)
+
+        n_pruned = len(pruned_vals)
+        changed = constraint.revise(pruned_vals)
+        constraint.n_revisions = constraint.n_revisions + 1
+        constraint.n_pruned = constraint.n_pruned + len(pruned_vals) - n_pruned
+        if changed is None:
+            # Domain wipeout
+            constraint.weight = constraint.weight + 1
+            return False, pruned_vals
+
+        if per_value:
+            for variable, _ in pruned_vals[n_pruned:]:
+                _enqueue(queue, in_queue, csp.get_cons_with_var(variable))
+        else:
+            for variable in changed:
+                _enqueue(queue, in_queue, csp.get_cons_with_var(variable))
 
     # No domain wipeout
     return True, pruned_vals
+
+
+def _enqueue(queue, in_queue, constraints):
+    '''Put the constraints that are not already queued on the GAC queue'''
+    for constr in constraints:
+        if constr not in in_queue:
+            queue.append(constr)
+            in_queue.add(constr)
+
+
+def prep_SAC(csp, propagator):
+    '''Singleton arc consistency (relative to the propagator): a value
+       is pruned if assigning it and calling the propagator gives a
+       deadend. The trial prunings are undone, and after the values of
+       a variable are tried the propagator is run at the root again if
+       any was pruned. Repeats until no value is pruned.'''
+    pruned_vals = []
+    changed = True
+    while changed:
+        changed = False
+        for variable in csp.get_all_vars():
+            if variable.is_assigned():
+                continue
+            removed = False
+            for value in variable.cur_domain():
+                variable.assign(value)
+                status, trial = propagator(csp, variable)
+                for var, val in trial:
+                    var.unprune_value(val)
+                variable.unassign()
+                if not status:
+                    variable.prune_value(value)
+                    pruned_vals.append((variable, value))
+                    removed = True
+            if not variable.cur_domain_size():
+                return False, pruned_vals
+            if removed:
+                changed = True
+                status, more = propagator(csp)
+                pruned_vals.extend(more)
+                if not status:
+                    return False, pruned_vals
+    return True, pruned_vals
+
+
+def prep_RPC(csp, propagator):
+    '''Restricted path consistency over the binary constraints: a
+       value a of x is pruned if it has no support b in y on a
+       constraint C(x,y) (arc consistency), or if b is its only support
+       and some variable z sharing a binary constraint with both x and
+       y has no value compatible with both a and b. Constraints of other
+       arities are left to the propagator, which is run at the root
+       after every round that pruned a value. Repeats until no value is
+       pruned.'''
+    binary = dict()     #(x, y) --> binary constraints over x and y
+    neighbours = dict() #x --> variables sharing a binary constraint with x
+    for c in csp.get_all_cons():
+        scope = c.get_scope()
+        if len(scope) == 2 and scope[0] is not scope[1]:
+            x, y = scope
+            binary.setdefault((x, y), []).append(c)
+            binary.setdefault((y, x), []).append(c)
+            neighbours.setdefault(x, set()).add(y)
+            neighbours.setdefault(y, set()).add(x)
+
+    def compatible(x, a, y, b):
+        for c in binary[(x, y)]:
+            if not c.check([a, b] if c.get_scope()[0] is x else [b, a]):
+                return False
+        return True
+
+    pruned_vals = []
+    changed = True
+    while changed:
+        changed = False
+        for (x, y), constraints in binary.items():
+            if x.is_assigned():
+                continue
+            for c in constraints:
+                c.n_revisions = c.n_revisions + 1
+            witnesses = neighbours[x] & neighbours[y]
+            for a in x.cur_domain():
+                supports = [b for b in y.cur_domain() if compatible(x, a, y, b)]
+                if len(supports) == 1:
+                    b = supports[0]
+                    for z in witnesses:
+                        if not any(compatible(x, a, z, v) and compatible(y, b, z, v)
+                                   for v in z.cur_domain()):
+                            supports = []
+                            break
+                if not supports:
+                    x.prune_value(a)
+                    pruned_vals.append((x, a))
+                    constraints[0].n_pruned = constraints[0].n_pruned + 1
+                    changed = True
+            if not x.cur_domain_size():
+                constraints[0].weight = constraints[0].weight + 1
+                return False, pruned_vals
+        if changed:
+            status, more = propagator(csp)
+            pruned_vals.extend(more)
+            if not status:
+                return False, pruned_vals
+    return True, pruned_vals
@@ -0,0 +1,147 @@
+'''Batch solving of Tenner Grids.
+
+   Boards are read as JSON lines, one board per line, either as the
+   pair [grid, last_row] used by tenner_csp (see tenner_csp_model_1)
+   or as an object {"id": ..., "grid": grid, "last_row": last_row}.
+   Results are written back as JSON lines in submission order
+
+   {"id": ..., "solution": grid or null, "decisions": n, "prunings": n,
+    "time": seconds}
+
+   (or {"id": ..., "error": message} for a line that can't be read).
+   The id of a board given as a pair is its line number (from 1).
+
+   Building the CSP dominates the cost of solving a board, so the model
+   is only built once for each number of rows (per process): a template
+   built for a blank board, with every cell's domain 0-9. A board then
+   only sets the template's column sums and fixes its own clues by
+   pruning the other values of their cells at the root of the search.
+
+   Run as
+
+   python tenner_batch.py [--model 1|2] [--processes N] < boards.jsonl
+'''
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from cspbase import *
+from propagators import *
+from tenner_csp import *
+from csp_parallel import fix_values
+
+#model number --> (model function, propagator)
+MODELS = {1: (tenner_csp_model_1, prop_FC),
+          2: (tenner_csp_model_2, prop_GAC)}
+
+_templates = dict()   #(model, number of rows) --> (var_array, sums, solver)
+
+def template(model, n_rows):
+    '''The cached template of model for boards with n_rows rows:
+       (var_array, sums, solver) where sums[x] is the sum constraint of
+       column x and solver is a BT object for the template's CSP.'''
+    key = (model, n_rows)
+    if not key in _templates:
+        blank = ([[-1] * 10 for _ in range(n_rows)], [0] * 10)
+        csp, var_array = MODELS[model][0](blank)
+        columns = dict()
+        for c in csp.get_all_cons():
+            if isinstance(c, LinearConstraint):
+                columns[c.get_scope()[0]] = c
+        sums = [columns[var] for var in var_array[0]]
+        _templates[key] = (var_array, sums, BT(csp))
+    return _templates[key]
+
+def solve_board(board, model=1):
+    '''Solve board, a pair (grid, last_row), using the template of model.
+       Returns (solution, nDecisions, nPrunings) where solution is the
+       grid of values, or None if the board has no solution.'''
+    grid, last_row = board
+    var_array, sums, solver = template(model, len(grid))
+    propagator = MODELS[model][1]
+
+    for c, total in zip(sums, last_row):
+        c.set_total(total)
+    clues = []
+    for i, row in enumerate(grid):
+        for j, val in enumerate(row):
+            if val != -1:
+                clues.append((i * 10 + j, val))
+
+    solver.clear_stats()
+    status = solver.bt_start(propagator)
+    if status:
+        status = fix_values(solver, propagator, clues)
+    if status:
+        status = solver.bt_resume()
+    solution = None
+    if status:
+        solution = [[var.get_assigned_value() for var in row] for row in var_array]
+    solver.bt_stop()
+    for row in var_array:
+        for var in row:
+            if var.is_assigned():
+                var.unassign()
+    return solution, solver.nDecisions, solver.nPrunings
+
+def read_boards(lines):
+    '''Generator of (id, board) from JSON lines, board is an error
+       message (a string) for a line that is not a board.'''
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            if isinstance(item, dict):
+                board_id = item.get("id", n)
+                board = (item["grid"], item["last_row"])
+            else:
+                board_id = n
+                board = (item[0], item[1])
+            if not 1 <= len(board[0]) or len(board[1]) != 10 or \
+               any(len(row) != 10 for row in board[0]):
+                raise ValueError("board must have rows of 10 cells")
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            yield n, "line {}: {}".format(n, e)
+            continue
+        yield board_id, board
+
+def _solve_job(job):
+    '''Solve one board of the batch (in a worker process)'''
+    board_id, board, model = job
+    if isinstance(board, str):
+        return {"id": board_id, "error": board}
+    stime = time.process_time()
+    solution, decisions, prunings = solve_board(board, model)
+    return {"id": board_id, "solution": solution, "decisions": decisions,
+            "prunings": prunings, "time": time.process_time() - stime}
+
+def solve_batch(boards, model=1, processes=None):
+    '''Generator of the results (see above) for boards, an iterable of
+       (id, board) pairs as given by read_boards, in the order of
+       boards. With processes > 1 (default os.cpu_count()) the boards
+       are solved by a pool of worker processes, each with its own
+       templates.'''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    jobs = ((board_id, board, model) for board_id, board in boards)
+    if processes <= 1:
+        for job in jobs:
+            yield _solve_job(job)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for result in pool.imap(_solve_job, jobs):
+                yield result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve Tenner Grids given as JSON lines")
+    parser.add_argument("--model", type=int, choices=sorted(MODELS), default=1)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    for result in solve_batch(read_boards(sys.stdin), args.model, args.processes):
+        print(json.dumps(result), flush=True)
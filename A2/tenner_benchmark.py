@@ -0,0 +1,110 @@
+'''Scaling benchmark of the Tenner Grid models.
+
+   For each number of rows, boards are made with tenner_generator (with
+   a unique solution, the same boards for every model and propagator)
+   and solved by models 1 and 2 of tenner_csp under prop_BT, prop_FC and
+   prop_GAC. Reported, averaged over the boards:
+
+   build      CPU seconds to build the CSP
+   solve      CPU seconds of the search
+   decisions  variable assignments
+   prunings   values pruned
+   KB         memory taken by the CSP (python allocations traced by
+              tracemalloc while building it, in a separate build so
+              tracing doesn't slow the timed runs)
+
+   A search is stopped after max_decisions assignments (shown as
+   ">max"), and a model/propagator pair that hits the limit is not run
+   on larger boards: that is where it stops scaling. Every solution is
+   checked against the rules of its board (see tenner_soln_errors);
+   a run that returns a wrong one is reported as "invalid".
+
+   python tenner_benchmark.py [--rows 3 4 5] [--boards 3] [--density 0.3]
+                              [--max-decisions 100000] [--seed 0]
+'''
+
+import argparse
+import time
+import tracemalloc
+
+from cspbase import *
+from propagators import *
+from tenner_csp import *
+from tenner_generator import make_board
+from tenner_sample_run import tenner_soln_errors
+
+MODELS = [("model 1", tenner_csp_model_1), ("model 2", tenner_csp_model_2)]
+PROPAGATORS = [prop_BT, prop_FC, prop_GAC]
+
+def run(model, propagator, board, max_decisions):
+    '''Build and solve board. Returns (build seconds, solve seconds,
+       decisions, prunings, solved, errors) where solved is None if the
+       search was stopped after max_decisions and errors lists the rules
+       of the board the solution found breaks (see tenner_soln_errors).'''
+    stime = time.process_time()
+    csp, var_array = model(board)
+    build = time.process_time() - stime
+
+    solver = BT(csp)
+    solver.clear_stats()
+    stime = time.process_time()
+    status = solver.bt_start(propagator)
+    if status:
+        status = solver.bt_resume(max_decisions)
+    solver.bt_stop()
+    solve = time.process_time() - stime
+    errors = []
+    if status:
+        errors = tenner_soln_errors(board, [[var.get_assigned_value() for var in row]
+                                            for row in var_array])
+    return build, solve, solver.nDecisions, solver.nPrunings, status, errors
+
+def model_memory(model, board):
+    '''Bytes allocated by building the CSP of board'''
+    tracemalloc.start()
+    built = model(board)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+def benchmark(rows, n_boards, density, max_decisions, seed=0):
+    print("{:>4} {:>8} {:>9} {:>8} {:>9} {:>11} {:>11} {:>9}".format(
+        "rows", "model", "propagator", "build", "solve", "decisions",
+        "prunings", "KB"))
+    stopped = set()
+    for n_rows in rows:
+        boards = [make_board(n_rows, density, seed * 1000 + n_rows * 100 + k)[0]
+                  for k in range(n_boards)]
+        for name, model in MODELS:
+            memory = sum(model_memory(model, b) for b in boards) / n_boards / 1024
+            for propagator in PROPAGATORS:
+                key = (name, propagator.__name__)
+                if key in stopped:
+                    continue
+                results = [run(model, propagator, b, max_decisions) for b in boards]
+                build, solve, decisions, prunings = [
+                    sum(r[i] for r in results) / n_boards for i in range(4)]
+                if any(r[4] is None for r in results):
+                    stopped.add(key)
+                    decisions = ">{}".format(max_decisions)
+                elif not all(r[4] for r in results):
+                    print("ERROR: a generated board was not solved")
+                    decisions = "unsolved"
+                elif any(r[5] for r in results):
+                    print("ERROR: invalid solution:", [r[5] for r in results if r[5]][0])
+                    decisions = "invalid"
+                else:
+                    decisions = "{:.0f}".format(decisions)
+                print("{:>4} {:>8} {:>9} {:>8.3f} {:>9.3f} {:>11} {:>11.0f} {:>9.0f}".format(
+                    n_rows, name, propagator.__name__, build, solve, decisions,
+                    prunings, memory), flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tenner Grid scaling benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[3, 4, 5, 6])
+    parser.add_argument("--boards", type=int, default=3)
+    parser.add_argument("--density", type=float, default=0.3)
+    parser.add_argument("--max-decisions", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.rows, args.boards, args.density, args.max_decisions, args.seed)
@@ -185,29 +185,10 @@ def create_model_1_constraints(variable_matrix, sum_row):
 def create_model_2_constraints(variable_matrix, sum_row):
     constraints = []
     for x, row in enumerate(variable_matrix):
-        # create n-ary row constraints
-        row_domain = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-
-        assigned_values = [v.get_assigned_value() for v in row]
-        unassigned_values = []
-        for val in row_domain:
-            if val not in assigned_values:
-                unassigned_values.append(val)
-
-        constraint = Constraint("Cons_{}".format(":".join([v.name for v in row])), row)
-
-        satisfying_tuples = []
-        for tup in itertools.permutations(unassigned_values):
-            sat_tup = [val for val in assigned_values]
-            for val in tup:
-                sat_tup[sat_tup.index(None)] = val
-
-            if len(set(sat_tup)) != len(sat_tup):
-                continue
-
-            satisfying_tuples.append(sat_tup)
-
-        constraint.add_satisfying_tuples(satisfying_tuples)
+        # create n-ary row constraints. A table would need every
+        # permutation of the free values, so use the global all-different
+        # constraint (GAC by bipartite matching) instead
+        constraint = AllDiffConstraint("Cons_{}".format(":".join([v.name for v in row])), row)
         constraints.append(constraint)
 
         # create contiguous cell constraints
@@ -226,36 +207,29 @@ def create_model_2_constraints(variable_matrix, sum_row):
 def create_column_sum_constraint(variable_matrix, x, expected_sum):
     column_variables = [row[x] for row in variable_matrix]
 
-    constraint = Constraint("Cons_{}".format(x), column_variables)
-    satisfying_tuples = list(itertools.product(*[v.domain() for v in column_variables]))
-    satisfying_tuples = [
-        tup
-        for tup in satisfying_tuples
-        if sum(tup) == expected_sum
-    ]
-
-    constraint.add_satisfying_tuples(satisfying_tuples)
-
-    return constraint
+    # the table of a column would hold every combination of column values
+    # adding up to the sum, so use the intensional sum constraint instead
+    return SumConstraint("Cons_{}".format(x), column_variables, expected_sum)
 
 
 def get_surrounding_variables(variable_matrix, x, y):
     '''
     given the indexes of an element of a matrix, return the values 
     the variables to the left, above, to the upper left diagonal, and
-    to the upper right diagonal.
+    to the upper right diagonal, in the order of their positions in
+    the matrix (so the constraints are always made in the same order).
     '''
-    surrounding_variables = []
+    positions = set()
     if x > 0:
-        surrounding_variables.append(variable_matrix[x - 1][y])
+        positions.add((x - 1, y))
     if y > 0:
-        surrounding_variables.append(variable_matrix[x][y - 1])
+        positions.add((x, y - 1))
     if x > 0 and y > 0:
-        surrounding_variables.append(variable_matrix[x - 1][y - 1])
+        positions.add((x - 1, y - 1))
     if x < len(variable_matrix) - 1 and y > 0:
-        surrounding_variables.append(variable_matrix[x + 1][y - 1])
+        positions.add((x + 1, y - 1))
 
-    return list(set(surrounding_variables))
+    return [variable_matrix[i][j] for i, j in sorted(positions)]
 
 
 def create_binary_constraints(variable, rest):
@@ -264,16 +238,17 @@ def create_binary_constraints(variable, rest):
     '''
     constraints = []
     for var in rest:
-        constraint = Constraint("Cons_{}:{}".format(variable.name, var.name), [variable, var])
-
-        satisfying_tuples = list(itertools.product(variable.domain(), var.domain()))
-        satisfying_tuples = [
+        # all not-equal constraints over the same pair of domains share
+        # one table, built the first time it is needed
+        domains = [variable.domain(), var.domain()]
+        table = shared_table("not-equal", domains, lambda: (
             tup
-            for tup in satisfying_tuples
+            for tup in itertools.product(*domains)
             if tup[0] != tup[1]
-        ]
+        ))
 
-        constraint.add_satisfying_tuples(satisfying_tuples)
+        constraint = Constraint("Cons_{}:{}".format(variable.name, var.name),
+                                [variable, var], table)
 
         constraints.append(constraint)
 
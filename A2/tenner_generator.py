@@ -0,0 +1,95 @@
+'''Random Tenner Grid puzzles.
+
+   make_board(n_rows, density, seed) returns a board in the format of
+   tenner_csp (a pair (grid, last_row), -1 for an empty cell). A random
+   solved grid is built row by row: each row is a permutation of 0-9
+   whose digits differ from the contiguous cells of the row above. The
+   column sums are taken from it, and about density of its cells are
+   shown as clues.
+
+   With unique=True clues are removed one at a time (in random order)
+   only while the puzzle keeps a unique solution, checked with
+   count_solutions (model 2 with GAC, stopping at 2 solutions). Below
+   some density no clue can be removed any more, so the board may keep
+   more clues than asked for.
+
+   python tenner_generator.py n_rows [density [seed]]
+'''
+
+import random
+import sys
+
+from cspbase import *
+from propagators import *
+from tenner_csp import *
+
+def random_row(above, rng):
+    '''A random permutation of 0-9 whose cells differ from the
+       contiguous cells of the row above (None for the first row), or
+       None if there is no such permutation.'''
+    row = []
+    used = set()
+    options = []    #digits still to try for each cell so far
+    while len(row) < 10:
+        j = len(row)
+        if len(options) == j:
+            digits = [d for d in range(10) if not d in used]
+            if above is not None:
+                digits = [d for d in digits if not d in above[max(j - 1, 0):j + 2]]
+            rng.shuffle(digits)
+            options.append(digits)
+        if options[j]:
+            d = options[j].pop()
+            row.append(d)
+            used.add(d)
+        else:
+            options.pop()
+            if not row:
+                return None
+            used.discard(row.pop())
+    return row
+
+def random_grid(n_rows, rng):
+    '''A random solved grid of n_rows rows'''
+    grid = []
+    while len(grid) < n_rows:
+        row = random_row(grid[-1] if grid else None, rng)
+        if row is None:
+            grid.pop()
+        else:
+            grid.append(row)
+    return grid
+
+def count_solutions(board, limit=2):
+    '''Number of solutions of board (at most limit)'''
+    csp, var_array = tenner_csp_model_2(board)
+    return BT(csp).count_solutions(prop_GAC, limit)
+
+def make_board(n_rows, density=0.4, seed=None, unique=True):
+    '''A random board with n_rows rows and about density * 10 * n_rows
+       clues (see above). Returns (board, solution) where solution is
+       the solved grid the board was made from.'''
+    rng = random.Random(seed)
+    solution = random_grid(n_rows, rng)
+    last_row = [sum(column) for column in zip(*solution)]
+    grid = [list(row) for row in solution]
+    cells = [(i, j) for i in range(n_rows) for j in range(10)]
+    rng.shuffle(cells)
+    n_clues = len(cells)
+    target = round(density * len(cells))
+    for i, j in cells:
+        if n_clues <= target:
+            break
+        grid[i][j] = -1
+        if unique and count_solutions((grid, last_row)) != 1:
+            grid[i][j] = solution[i][j]
+        else:
+            n_clues = n_clues - 1
+    return (grid, last_row), solution
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    density = float(sys.argv[2]) if len(sys.argv) > 2 else 0.4
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    (grid, last_row), solution = make_board(n_rows, density, seed)
+    print((grid, last_row))
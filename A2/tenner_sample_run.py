@@ -16,10 +16,42 @@ b2 = ([[6, -1, 1, 5, 7, -1, -1, -1, 3, -1],
        [6, -1, -1, 5, -1, 0, -1, -1, -1, -1],],
       [21, 26, 21, 21, 29, 10, 28, 26, 21, 22])
 
+b3 = ([[-1, 5, -1, 3, 7, 0, -1, 8, -1, -1],
+       [ 3,-1,-1, 9,-1,-1,-1, 4, 7,-1],
+       [-1,-1, 6,-1,-1, 2,-1,-1,-1, 4]],
+      [18,13, 9,17,15, 8,21,15, 9,10])
+
 def print_tenner_soln(var_array):
     for row in var_array:
         print([var.get_assigned_value() for var in row])
 
+def tenner_soln_errors(board, grid):
+    '''List of the rules of board that grid (a list of rows of values)
+       breaks, empty if grid is a solution of board'''
+    clues, last_row = board
+    errors = []
+    if len(grid) != len(clues):
+        return ["grid has {} rows, board has {}".format(len(grid), len(clues))]
+    for i, row in enumerate(grid):
+        if sorted(row) != list(range(10)):
+            errors.append("row {} does not have 10 different digits".format(i))
+        for j, val in enumerate(row):
+            if clues[i][j] != -1 and clues[i][j] != val:
+                errors.append("cell {},{} is not the clue {}".format(i, j, clues[i][j]))
+            if i > 0 and val in grid[i - 1][max(j - 1, 0):j + 2]:
+                errors.append("cell {},{} repeats a contiguous cell".format(i, j))
+    for j in range(10):
+        if sum(row[j] for row in grid) != last_row[j]:
+            errors.append("column {} does not sum to {}".format(j, last_row[j]))
+    return errors
+
+def check_tenner_soln(board, var_array):
+    '''Print whether the variables hold a solution of board'''
+    errors = tenner_soln_errors(board, [[var.get_assigned_value() for var in row]
+                                        for row in var_array])
+    print("Solution is valid" if not errors else "INVALID solution: {}".format(errors))
+    return not errors
+
 if __name__ == "__main__":
 
     for b in [b1, b2]:
@@ -35,6 +67,7 @@ if __name__ == "__main__":
         solver.bt_search(prop_FC)
         print("Solution")
         print_tenner_soln(var_array)
+        check_tenner_soln(b, var_array)
         
         print("Using Model 2")
         csp, var_array = tenner_csp_model_2(b)
@@ -44,4 +77,20 @@ if __name__ == "__main__":
         solver.bt_search(prop_GAC)
         print("Solution")
         print_tenner_soln(var_array)
+        check_tenner_soln(b, var_array)
+
+    #model 2 only checks a row's all-different constraint under FC once
+    #a single cell of the row is left, too weak for b1 and b2
+    print("Solving board:")
+    for row in b3[0]:
+        print(row)
+    print("Using Model 2")
+    csp, var_array = tenner_csp_model_2(b3)
+    solver = BT(csp)
+    print("=======================================================")
+    print("FC")
+    solver.bt_search(prop_FC)
+    print("Solution")
+    print_tenner_soln(var_array)
+    check_tenner_soln(b3, var_array)
 
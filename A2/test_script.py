@@ -0,0 +1,175 @@
+
+# import the CSP routines and propagators
+import itertools
+import random
+
+from cspbase import *
+from propagators import *
+from tenner_csp import *
+from tenner_sample_run import b1, b2, b3, tenner_soln_errors
+from csp_sample_run import nQueens, add_nQueens_symmetries
+
+# Select what to test
+test_propagator_counts = True
+test_compact_tables = True
+test_tenner_models = True
+test_symmetries = True
+
+def brute_force_count(csp):
+    '''Number of solutions of csp, by trying every assignment'''
+    variables = csp.get_all_vars()
+    fixed = dict(csp.get_assignments())
+    count = 0
+    for vals in itertools.product(*[var.domain() for var in variables]):
+        values = dict(zip(variables, vals))
+        if any(values[var] != val for var, val in fixed.items()):
+            continue
+        if all(c.check([values[var] for var in c.get_scope()]) for c in csp.get_all_cons()):
+            count += 1
+    return count
+
+def random_csp(seed):
+    '''A small random CSP mixing every kind of constraint'''
+    rng = random.Random(seed)
+    n = rng.randint(2, 6)
+    variables = [Variable('V{}'.format(i), rng.sample(range(5), rng.randint(1, 4)))
+                 for i in range(n)]
+    csp = CSP('Random{}'.format(seed), variables)
+    for k in range(rng.randint(1, 6)):
+        kind = rng.randrange(6)
+        scope = rng.sample(variables, rng.randint(1, min(4, n)))
+        name = 'C{}'.format(k)
+        if kind == 0:
+            c = Constraint(name, scope)
+            c.add_satisfying_tuples(t for t in itertools.product(*[v.domain() for v in scope])
+                                    if rng.random() < 0.6)
+        elif kind == 1:
+            m = rng.randint(2, 4)
+            c = FunctionConstraint(name, scope, lambda vals, m=m: sum(vals) % m != 0)
+        elif kind == 2 and len(scope) >= 2:
+            c = NotEqualConstraint(name, scope[:2])
+        elif kind == 3:
+            c = AllDiffConstraint(name, scope)
+        elif kind == 4:
+            c = SumConstraint(name, scope, rng.randint(0, 10))
+        else:
+            c = LinearConstraint(name, scope, [rng.choice([1, 2, -1]) for _ in scope],
+                                 rng.randint(-3, 8))
+        csp.add_constraint(c)
+    return csp
+
+if test_propagator_counts:
+    ##############################################################
+    # TEST SOLUTION COUNTS OF EVERY PROPAGATOR
+    print('Testing solution counts of prop_BT, prop_FC, prop_GAC and prop_GAC_value against brute force')
+
+    # All different over 3 variables with 3 values: 3! solutions
+    variables = [Variable('X{}'.format(i), [0, 1, 2]) for i in range(3)]
+    csp = CSP('AllDiff', variables)
+    csp.add_constraint(AllDiffConstraint('AllDiff', variables))
+
+    wrong = []
+    for propagator in [prop_BT, prop_FC, prop_GAC, prop_GAC_value]:
+        count = BT(csp).count_solutions(propagator)
+        print('{} counts {} solutions of AllDiff(X0, X1, X2)'.format(propagator.__name__, count))
+        if count != 6:
+            wrong.append(('AllDiff', propagator.__name__))
+
+    n_csps = 300
+    for seed in range(n_csps):
+        csp = random_csp(seed)
+        expected = brute_force_count(csp)
+        for propagator in [prop_BT, prop_FC, prop_GAC, prop_GAC_value]:
+            for decompose in [True, False]:
+                count = BT(csp).count_solutions(propagator, decompose=decompose)
+                if count != expected:
+                    wrong.append((csp.name, propagator.__name__, decompose, count, expected))
+
+    print("*************************************")
+    print("Counted the solutions of {} random CSPs, {} counts were wrong.".format(n_csps, len(wrong)))
+    print("Wrong counts: {}".format(wrong))
+    print("*************************************\n")
+    ##############################################################
+
+if test_compact_tables:
+    ##############################################################
+    # TEST COMPACT TABLE SUPPORT CHECKING
+    print('Testing prop_GAC with compact tables against plain support checking')
+
+    # the valid rows are the same either way, so GAC must count the same
+    # solutions and prune the same values
+    wrong = []
+    n_csps = 300
+    for seed in range(n_csps):
+        csp = random_csp(seed)
+        expected = brute_force_count(csp)
+        plain = BT(csp)
+        plain_count = plain.count_solutions(prop_GAC, decompose=False)
+        for c in csp.get_all_cons():
+            if type(c) is Constraint:
+                c.use_compact_table()
+        compact = BT(csp)
+        count = compact.count_solutions(prop_GAC, decompose=False)
+        if count != expected or plain_count != expected or compact.nPrunings != plain.nPrunings:
+            wrong.append((csp.name, count, plain_count, expected,
+                          compact.nPrunings, plain.nPrunings))
+
+    print("*************************************")
+    print("Solved {} random CSPs with compact tables, {} runs were wrong.".format(n_csps, len(wrong)))
+    print("Wrong runs: {}".format(wrong))
+    print("*************************************\n")
+    ##############################################################
+
+if test_tenner_models:
+    ##############################################################
+    # TEST TENNER MODELS WITH EVERY PROPAGATOR
+    print('Testing Tenner models 1 and 2 with prop_FC and prop_GAC')
+
+    # model 2 with prop_FC is too weak for the 5 row boards
+    runs = [('b1', b1), ('b2', b2), ('b3', b3)]
+    runs = [(name, board, model, propagator) for name, board in runs
+            for model in [tenner_csp_model_1, tenner_csp_model_2]
+            for propagator in [prop_FC, prop_GAC]
+            if name == 'b3' or model != tenner_csp_model_2 or propagator != prop_FC]
+
+    wrong = []
+    for name, board, model, propagator in runs:
+        csp, var_array = model(board)
+        solver = BT(csp)
+        stats = solver.bt_search(propagator)
+        grid = [[var.get_assigned_value() for var in row] for row in var_array]
+        errors = tenner_soln_errors(board, grid) if stats.solved else ['unsolved']
+        if errors:
+            wrong.append((name, model.__name__, propagator.__name__, errors))
+
+    print("*************************************")
+    print("Made {} Tenner runs, {} solutions were wrong.".format(len(runs), len(wrong)))
+    print("Wrong solutions: {}".format(wrong))
+    print("*************************************\n")
+    ##############################################################
+
+if test_symmetries:
+    ##############################################################
+    # TEST SYMMETRY BREAKING ON N-QUEENS
+    print('Testing n-queens solution counts with the board symmetries declared')
+
+    # symmetries are only broken after symmetry_on: enumeration then
+    # finds one solution of each class, and counting still gives the total
+    n_solutions = {4: 2, 5: 10, 6: 4, 7: 40, 8: 92}
+    wrong = []
+    for n, expected in n_solutions.items():
+        csp = nQueens(n)
+        add_nQueens_symmetries(csp)
+        solver = BT(csp)
+        found = len(list(solver.enumerate_solutions(prop_FC)))
+        solver.symmetry_on()
+        count = solver.count_solutions(prop_FC)
+        leaders = len(list(solver.enumerate_solutions(prop_FC)))
+        if found != expected or count != expected or not 0 < leaders < expected:
+            wrong.append((n, found, count, leaders, expected))
+
+    print("*************************************")
+    print("Counted {} n-queens problems with symmetries, {} counts were wrong.".format(len(n_solutions), len(wrong)))
+    print("Wrong counts: {}".format(wrong))
+    print("*************************************\n")
+    ##############################################################